@@ -0,0 +1,299 @@
+"""
+This program benchmarks generator.py and cov19_con_trace.py at several population sizes. For
+every size it times the generation of a dataset and every stage of a tracing run (dataprep,
+graph_per_person, build_bigdaddy, overlaps_for_pop, each step of run_graph_analysis, ...) and
+records their wall time, cpu time & peak memory. A power law (secs = a * people ^ b) is fitted
+to every stage over the sizes to show how it scales.
+
+Sizes that have a dataset in this repo (e.g. the 1k & 2k datasets in large_pop_datasets_only)
+are traced on that dataset, other sizes on a synthetic dataset made by the generation runs.
+Every run is a separate process with a time & memory limit. A run that fails or hits a limit
+is recorded as such, together with the stages it completed.
+
+The results are written to benchmark.json in bench_folder, together with the commit and the
+machine they were measured on, and the fitted curves to benchmark_scaling.png. Two result files
+(e.g. of two commits) can be compared with:
+
+python benchmark.py --compare old.json new.json
+
+Dependencies:
+ - Python 2.7 only (latlon doesn't support Python 3 :(.)
+ - the dependencies of generator.py and cov19_con_trace.py
+
+"""
+
+import os
+import sys
+import json
+import time
+import datetime
+import platform
+import subprocess
+import argparse
+import resource
+from collections import OrderedDict
+import numpy as np
+import matplotlib
+matplotlib.use('Agg') #plots are only saved
+import matplotlib.pyplot as plt
+
+##### All configurations start here #####
+
+#population sizes to benchmark
+bench_sizes = [10, 100, 1000, 2000, 10000]
+
+#datasets of this repo (relative to this program) used to trace some of the sizes. Sizes not
+#listed here are traced on the dataset generated by the 'numpy' generation run of that size.
+bench_datasets = {
+    10: 'cov19_gen_dataset_pop-10_sickper-03_startloc-10/microcell_radius_0.01metres/cov19_gen_dataset_pop-10_sickper-03_startloc-10.csv',
+    1000: 'large_pop_datasets_only/cov19_gen_dataset_1k.csv',
+    2000: 'large_pop_datasets_only/cov19_gen_dataset_2k.csv'}
+
+#generation engines benchmarked (see generation_engine in generator.py). The 'classic' engine
+#takes a few seconds per person so it is only run up to bench_classic_max_pop people.
+bench_gen_engines = ['numpy', 'classic']
+bench_classic_max_pop = 100
+
+#generator options for the synthetic datasets
+bench_seed = 1
+bench_sick_percent = 3
+bench_startloc = 7
+
+#command line options of the tracing runs. The 'brute' engine compares every pair of
+#locations, which is out of reach beyond a few hundred people.
+bench_trace_options = ['--engine', 'grid', '--kernel', 'numpy', '--radius', '0.005']
+
+#limits of every run: wall time (s) & memory (MB, address space). 0 = no limit.
+bench_timeout = 1800
+bench_memory_mb = 4096
+
+#a stage is reported as a regression by --compare when it is this much slower (or needs this
+#much more memory) than before
+bench_regression = 1.2
+
+#folder the runs & results are written to
+bench_folder = 'benchmark'
+
+##### All configurations end here   #####
+
+#the programs benchmarked, next to this one
+code_folder = os.path.dirname(os.path.abspath(__file__))
+
+##### Non main methods #####
+
+#prints with the same marker as the other programs
+def printcov(str_to_print):
+    print("[log]:--> " + str_to_print)
+
+#sets the memory limit in a run's process before it starts
+def limit_memory():
+    if(bench_memory_mb > 0):
+        limit = bench_memory_mb * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+
+#runs one of the programs with args in folder (output discarded) within the limits. Returns
+#the status ('ok', 'failed' or 'timeout'), wall time, cpu time & peak memory (MB) of the run.
+def run_program(program, args, folder):
+    if(not os.path.isdir(folder)):
+        os.makedirs(folder)
+    devnull = open(os.devnull, 'w')
+    started = time.time()
+    proc = subprocess.Popen([sys.executable, os.path.join(code_folder, program)] + args,
+        cwd=folder, stdout=devnull, stderr=subprocess.STDOUT, preexec_fn=limit_memory)
+    status = None
+    while(status is None):
+        pid, rc, usage = os.wait4(proc.pid, os.WNOHANG)
+        if(pid == proc.pid):
+            status = 'ok' if rc == 0 else 'failed'
+        elif(bench_timeout > 0 and time.time() - started > bench_timeout):
+            proc.kill()
+            pid, rc, usage = os.wait4(proc.pid, 0)
+            status = 'timeout'
+        else:
+            time.sleep(0.05)
+    proc.returncode = rc #reaped here, not by Popen
+    devnull.close()
+    return (status, time.time() - started, usage.ru_utime + usage.ru_stime,
+        usage.ru_maxrss / 1024)
+
+#one benchmark result
+def result(program, stage, people, status, secs, cpu_secs, peak_mb):
+    return OrderedDict([('program', program), ('stage', stage), ('people', people),
+        ('status', status), ('secs', secs), ('cpu_secs', cpu_secs), ('peak_mb', peak_mb)])
+
+#generates a dataset of people people with engine. Returns its result & the path of the data.
+def bench_generation(people, engine):
+    folder = os.path.join(bench_folder, "gen_" + engine + "_" + str(people))
+    status, secs, cpu, peak = run_program("generator.py", ['--no-pause', '--pop', str(people),
+        '--sick-percent', str(bench_sick_percent), '--startloc', str(bench_startloc), '--engine',
+        engine, '--seed', str(bench_seed)], folder)
+    printcov("Generation of: " + str(people) + " people with the: " + engine + " engine: "
+        + status + " in: " + str(round(secs, 2)) + " s, peak memory: " + str(peak) + " MB")
+    return (result('generator', 'generate_' + engine, people, status, secs, cpu, peak),
+        os.path.abspath(os.path.join(folder, "cov19_gen_dataset.csv")))
+
+#traces the dataset at datapath (people people). Returns the results of all stages that
+#completed and of the whole run (stage 'total'). The artifact cache is off so that every
+#stage is run & timed.
+def bench_tracing(people, datapath):
+    folder = os.path.join(bench_folder, "trace_" + str(people))
+    stagefile = os.path.abspath(os.path.join(folder, "stages.json"))
+    if(os.path.exists(stagefile)):
+        os.remove(stagefile)
+    status, secs, cpu, peak = run_program("cov19_con_trace.py", ['--no-pause', '--datapath',
+        datapath, '--metrics', stagefile, '--cache-max-mb', '0'] + bench_trace_options, folder)
+    printcov("Tracing of: " + str(people) + " people: " + status + " in: " + str(round(secs, 2))
+        + " s, peak memory: " + str(peak) + " MB")
+    results = []
+    if(os.path.exists(stagefile)):
+        for s in json.load(open(stagefile))['stages']:
+            results.append(result('cov19_con_trace', s['stage'], people, 'ok', s['secs'],
+                s['cpu_secs'], s['peak_mb']))
+            print("    " + s['stage'] + ": " + str(round(s['secs'], 3)) + " s")
+    results.append(result('cov19_con_trace', 'total', people, status, secs, cpu, peak))
+    return results
+
+#fits secs = a * people ^ b to the completed results of every stage with at least two sizes
+def fit_scaling(results):
+    fits = []
+    stages = OrderedDict()
+    for r in results:
+        if(r['status'] == 'ok' and r['secs'] > 0):
+            stages.setdefault((r['program'], r['stage']), []).append(r)
+    for (program, stage), rs in stages.items():
+        if(len(set([r['people'] for r in rs])) < 2):
+            continue
+        b, loga = np.polyfit(np.log([r['people'] for r in rs]), np.log([r['secs'] for r in rs]), 1)
+        fits.append(OrderedDict([('program', program), ('stage', stage), ('a', float(np.exp(loga))),
+            ('b', float(b)), ('sizes', sorted(set([r['people'] for r in rs])))]))
+    return fits
+
+#plots the results & fitted curves of every stage on log-log axes
+def plot_scaling(results, fits, path):
+    plt.figure(figsize=(12, 9))
+    for k in range(0, len(fits)):
+        f = fits[k]
+        rs = [r for r in results if r['program'] == f['program'] and r['stage'] == f['stage']
+            and r['status'] == 'ok']
+        x = np.array(sorted([r['people'] for r in rs]), dtype=float)
+        #colours repeat after 10 curves, the line style tells them apart
+        line = plt.plot(x, f['a'] * x ** f['b'], ['-', '--', ':'][(k // 10) % 3],
+            label=f['stage'] + " (b = " + str(round(f['b'], 2)) + ")")
+        plt.scatter([r['people'] for r in rs], [r['secs'] for r in rs], color=line[0].get_color())
+    plt.xscale('log')
+    plt.yscale('log')
+    plt.xlabel('people')
+    plt.ylabel('seconds')
+    plt.legend(fontsize='small', loc='upper left')
+    plt.savefig(path)
+    return
+
+#commit of the code benchmarked, with '+' appended if there are uncommitted changes
+def commit_id():
+    try:
+        commit = subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=code_folder).strip()
+        dirty = subprocess.check_output(['git', 'status', '--porcelain', '--untracked-files=no'],
+            cwd=code_folder).strip()
+        return commit + ('+' if dirty else '')
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+#the machine the benchmark runs on
+def machine_info():
+    return OrderedDict([('platform', platform.platform()), ('python', platform.python_version()),
+        ('cpus', os.sysconf('SC_NPROCESSORS_ONLN')),
+        ('memory_mb', os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES') // (1024 * 1024))])
+
+#runs all benchmarks & saves the results to path
+def run_benchmarks(path):
+    results = []
+    for people in bench_sizes:
+        datapath = None
+        for engine in bench_gen_engines:
+            if(engine == 'classic' and people > bench_classic_max_pop):
+                continue
+            r, data = bench_generation(people, engine)
+            results.append(r)
+            if(engine == 'numpy' and r['status'] == 'ok'):
+                datapath = data
+        if(people in bench_datasets):
+            datapath = os.path.join(code_folder, bench_datasets[people])
+        if(datapath is None):
+            printcov("No dataset to trace: " + str(people) + " people.")
+            continue
+        results.extend(bench_tracing(people, datapath))
+
+    fits = fit_scaling(results)
+    printcov("Fitted scaling (secs = a * people ^ b): ")
+    for f in fits:
+        print("    " + f['program'] + " " + f['stage'] + ": a = " + ('%.3g' % f['a']) + ", b = "
+            + ('%.2f' % f['b']) + " over: " + str(f['sizes']))
+    if(len(fits) > 0):
+        plot_scaling(results, fits, os.path.join(bench_folder, "benchmark_scaling.png"))
+
+    out = open(path, 'w')
+    json.dump(OrderedDict([('commit', commit_id()), ('date', datetime.datetime.now().isoformat()),
+        ('machine', machine_info()), ('config', OrderedDict([('sizes', bench_sizes),
+        ('datasets', dict((str(k), v) for k, v in bench_datasets.items())),
+        ('gen_engines', bench_gen_engines), ('seed', bench_seed), ('sick_percent', bench_sick_percent),
+        ('startloc', bench_startloc), ('trace_options', bench_trace_options),
+        ('timeout', bench_timeout), ('memory_mb', bench_memory_mb)])),
+        ('results', results), ('fits', fits)]), out, indent=1)
+    out.close()
+    printcov("Saved benchmark results to: " + path)
+    return results
+
+#compares two result files stage by stage & size by size. Returns the no of regressions.
+def compare_benchmarks(oldpath, newpath):
+    old = json.load(open(oldpath))
+    new = json.load(open(newpath))
+    printcov("Comparing: " + oldpath + " (" + old['commit'] + ") with: " + newpath + " ("
+        + new['commit'] + ")")
+    before = dict(((r['program'], r['stage'], r['people']), r) for r in old['results'])
+    regressions = 0
+    for r in new['results']:
+        o = before.get((r['program'], r['stage'], r['people']))
+        if(o is None):
+            continue
+        line = (r['program'] + " " + r['stage'] + " @ " + str(r['people']) + ": ")
+        if(o['status'] != 'ok' or r['status'] != 'ok'):
+            print("    " + line + o['status'] + " -> " + r['status'])
+            if(o['status'] == 'ok'):
+                regressions = regressions + 1
+            continue
+        tratio = r['secs'] / max(o['secs'], 1e-6)
+        mratio = r['peak_mb'] / float(max(o['peak_mb'], 1))
+        flag = ''
+        #stages that take less than a hundredth of a second are too noisy to flag
+        if((tratio > bench_regression and r['secs'] > 0.01) or mratio > bench_regression):
+            flag = '  <== REGRESSION'
+            regressions = regressions + 1
+        print("    " + line + ('%.3f' % o['secs']) + " s -> " + ('%.3f' % r['secs']) + " s (x"
+            + ('%.2f' % tratio) + "), " + str(o['peak_mb']) + " MB -> " + str(r['peak_mb'])
+            + " MB (x" + ('%.2f' % mratio) + ")" + flag)
+    printcov("Found: " + str(regressions) + " regressions.")
+    return regressions
+
+##### main #####
+
+parser = argparse.ArgumentParser(description='Benchmarks of the generator & contact tracing.')
+parser.add_argument('--sizes', default=','.join([str(n) for n in bench_sizes]), metavar='N,N,..',
+    help='population sizes to benchmark (default: ' + ','.join([str(n) for n in bench_sizes]) + ')')
+parser.add_argument('--output', default=os.path.join(bench_folder, 'benchmark.json'), metavar='FILE',
+    help='file the results are saved to (default: ' + os.path.join(bench_folder, 'benchmark.json') + ')')
+parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'),
+    help='compare two result files instead of benchmarking')
+args = parser.parse_args()
+
+if(args.compare is not None):
+    sys.exit(1 if compare_benchmarks(args.compare[0], args.compare[1]) > 0 else 0)
+
+bench_sizes = [int(n) for n in args.sizes.split(',')]
+if(not os.path.isdir(bench_folder)):
+    os.makedirs(bench_folder)
+printcov("Starting benchmarks for: " + str(bench_sizes) + " people.")
+print("Tracing options: " + ' '.join(bench_trace_options))
+print("Limits per run: " + str(bench_timeout) + " s, " + str(bench_memory_mb) + " MB")
+print('-------------------------------------')
+run_benchmarks(args.output)
+printcov("Completed benchmarks.")
@@ -0,0 +1,277 @@
+"""
+This program answers contact queries on the contact index that cov19_con_trace.py saves with
+every run (the contact_index folder, see save_contact_index there):
+
+python contact_query.py contacts NAME      who NAME came within the microcell radius of & when
+python contact_query.py exposure NAME      how early NAME can have been exposed & through whom
+python contact_query.py hotspots [N]       the N locations with the most contacts
+python contact_query.py near LAT LON [KM]  the locations visited within KM of a point
+python contact_query.py serve [--port P]   answers the same queries over http, as json:
+                                           /contacts?name=NAME, /exposure?name=NAME,
+                                           /hotspots?n=N, /near?lat=LAT&lon=LON&km=KM
+
+The index is memory mapped, so opening it only reads the names of the people and every query
+only reads the rows it returns. The functions below can also be used from python:
+
+index = open_index('contact_index')
+query_contacts(index, 'CVRBBLL')
+
+Dependencies:
+ - numpy & pandas (the versions cov19_con_trace.py uses)
+
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+try:
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+    from urlparse import urlparse, parse_qs
+except ImportError:
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+    from urllib.parse import urlparse, parse_qs
+
+##### All configurations start here #####
+
+#folder of the contact index, as saved by cov19_con_trace.py (see contact_index_path there)
+index_path = 'contact_index'
+
+#no of locations listed by a hotspot query unless asked for another no
+hotspot_count = 5
+
+#radius (km) of a near query unless asked for another radius
+near_radius = 0.01
+
+#port the http server listens on (localhost only)
+server_port = 8019
+
+##### All configurations end here   #####
+
+#smallest radius of curvature of the WGS84 ellipsoid (km), as in cov19_con_trace.py. Used to
+#find the grid cells a near query has to look at.
+earth_min_radius = 6335.4
+
+#mean radius of the earth (km), for the distances of near queries
+earth_mean_radius = 6371.0088
+
+#arguments of every query, in order, and how many of them must be given
+query_args = {'contacts': (['name'], 1), 'exposure': (['name'], 1), 'hotspots': (['n'], 0),
+    'near': (['lat', 'lon', 'km'], 2)}
+
+##### Non main methods #####
+
+#prints with the same marker as the other programs
+def printcov(str_to_print):
+    print("[log]:--> " + str_to_print)
+
+#text saved by numpy comes back as bytes on python 3
+def as_str(b):
+    if(isinstance(b, str)):
+        return b
+    return b.decode()
+
+#file name used for a column in a columns folder, as in cov19_con_trace.py
+def column_file(path, col):
+    return os.path.join(path, col + '.npy')
+
+#memory maps all columns & extra arrays of a columns folder written by save_columns in
+#cov19_con_trace.py. Returns a dict of name -> array & a dict of text column -> categories.
+def load_columns(path):
+    cols = {}
+    cats = {}
+    for f in os.listdir(path):
+        name = f[:-len('.npy')]
+        if(name == 'columns'):
+            continue
+        if(name.endswith('_categories')):
+            cats[name[:-len('_categories')]] = [as_str(c) for c in np.load(os.path.join(path, f))]
+        else:
+            cols[name] = np.load(os.path.join(path, f), mmap_mode='r')
+    return cols, cats
+
+#opens the contact index at path. Returns a dict of the people, visits, contacts & cells
+#columns, the grid & the person id of every name.
+def open_index(path):
+    index = {}
+    for part in ['people', 'visits', 'contacts', 'cells']:
+        index[part], cats = load_columns(os.path.join(path, part))
+        if(part == 'people'):
+            index['names'] = cats['name']
+    index['names'] = [index['names'][c] for c in np.asarray(index['people']['name'])]
+    index['pidof'] = dict((index['names'][p], p) for p in range(0, len(index['names'])))
+    index['grid'] = np.load(os.path.join(path, 'grid.npy'))
+    return index
+
+#person id of name. Raises KeyError if name is not in the index.
+def person_id(index, name):
+    if(name not in index['pidof']):
+        raise KeyError("Unknown person: " + name)
+    return index['pidof'][name]
+
+#columns of the given visits (index array) as a dataframe, with the name of the person of
+#each. prefix is put in front of every column name.
+def visit_frame(index, visits, prefix=''):
+    v = index['visits']
+    return pd.DataFrame(OrderedDict([(prefix + 'name', np.array(index['names'], dtype=object)[v['person'][visits]])]
+        + [(prefix + c, v[c][visits]) for c in ['seq', 'lat', 'lon', 'entry', 'exit']]))
+
+#every contact of the person name, by their visit & start time: their visit, the visit of
+#the other person, the start & end of their time overlap (-1 = none), whether it was high risk
+#and the distance between them (km).
+def query_contacts(index, name):
+    people = index['people']
+    p = person_id(index, name)
+    first = people['first'][p]
+    offsets = index['visits']['contact_offsets']
+    rows = np.arange(offsets[first], offsets[first + people['count'][p]])
+    c = index['contacts']
+    df = pd.concat([visit_frame(index, c['visit'][rows]), visit_frame(index, c['other'][rows], 'other_')], axis=1)
+    for col in ['start', 'end', 'high_risk', 'distance']:
+        df[col] = c[col][rows]
+    return df
+
+#exposure of the person name (see trace_exposure in cov19_con_trace.py): sick, the earliest
+#time they can have been exposed (hhmm), the no of contacts from a known infected person and
+#the chain of people the exposure came through, starting from the known infected person.
+def query_exposure(index, name):
+    people = index['people']
+    p = person_id(index, name)
+    chain = [name]
+    q = p
+    while(people['via'][q] >= 0 and len(chain) <= people['hops'][p]):
+        q = people['via'][q]
+        chain.insert(0, index['names'][q])
+    return {'name': name, 'sick': bool(people['sick'][p]),
+        'exposed_at': int(people['exposed_at'][p]), 'hops': int(people['hops'][p]),
+        'chain': chain}
+
+#the n visits with the most contacts, with their no of contacts & high risk contacts
+def query_hotspots(index, n):
+    offsets = np.asarray(index['visits']['contact_offsets'])
+    counts = np.diff(offsets)
+    top = np.argsort(-counts, kind='mergesort')[:n]
+    high = np.asarray(index['contacts']['high_risk'])
+    df = visit_frame(index, top)
+    df['contacts'] = counts[top]
+    df['high_risk'] = [int(high[offsets[i]:offsets[i+1]].sum()) for i in top]
+    return df
+
+#the visits within km of the point lat, lon, nearest first, with their distance (km). Only the
+#grid cells around the point are read.
+def query_near(index, lat, lon, km):
+    cell_lat, cell_lon, origin_lat, origin_lon, span = index['grid']
+    dlat = np.degrees(km / earth_min_radius)
+    dlon = dlat / max(np.cos(np.radians(min(abs(lat) + dlat, 89.0))), 1e-6)
+    cx = np.arange(np.floor((lat - dlat - origin_lat) / cell_lat), np.floor((lat + dlat - origin_lat) / cell_lat) + 1)
+    cy = np.arange(np.floor((lon - dlon - origin_lon) / cell_lon), np.floor((lon + dlon - origin_lon) / cell_lon) + 1)
+    keys = (cx[:, None] * span + cy[None, :]).astype(np.int64).ravel()
+    cells = index['cells']
+    cellkeys = np.asarray(cells['key'])
+    pos = np.searchsorted(cellkeys, keys)
+    found = pos < len(cellkeys)
+    found[found] = cellkeys[pos[found]] == keys[found]
+    pos = pos[found]
+    bycell = index['visits']['by_cell']
+    visits = np.concatenate([np.asarray(bycell[cells['first'][k]:cells['first'][k] + cells['count'][k]])
+        for k in pos] + [np.zeros(0, dtype=np.int64)])
+    v = index['visits']
+    la1, lo1, la2, lo2 = np.radians(lat), np.radians(lon), np.radians(v['lat'][visits]), np.radians(v['lon'][visits])
+    d = 2 * earth_mean_radius * np.arcsin(np.sqrt(np.sin((la2 - la1) / 2) ** 2
+        + np.cos(la1) * np.cos(la2) * np.sin((lo2 - lo1) / 2) ** 2))
+    keep = np.nonzero(d <= km)[0]
+    keep = keep[np.argsort(d[keep], kind='mergesort')]
+    df = visit_frame(index, visits[keep])
+    df['distance'] = d[keep]
+    return df
+
+#answers one query, given as the query name & its arguments. Returns the result & the time
+#it took (ms). Raises ValueError for an unknown query or the wrong no of arguments.
+def answer(index, query, args):
+    started = time.time()
+    if(query not in query_args):
+        raise ValueError("Unknown query: " + query)
+    names, required = query_args[query]
+    if(len(args) < required or len(args) > len(names)):
+        raise ValueError(query + " takes: " + ' '.join(names[:required] + ['[' + a + ']'
+            for a in names[required:]]) + " (got " + str(len(args)) + " arguments)")
+    if(query == 'contacts'):
+        result = query_contacts(index, args[0])
+    elif(query == 'exposure'):
+        result = query_exposure(index, args[0])
+    elif(query == 'hotspots'):
+        result = query_hotspots(index, int(args[0]) if args else hotspot_count)
+    elif(query == 'near'):
+        result = query_near(index, float(args[0]), float(args[1]), float(args[2]) if len(args) > 2 else near_radius)
+    return result, (time.time() - started) * 1000
+
+#result of a query as json
+def to_json(result):
+    if(isinstance(result, pd.DataFrame)):
+        return result.to_json(orient='records')
+    return json.dumps(result)
+
+#answers queries over http with the index opened once by serve
+class QueryHandler(BaseHTTPRequestHandler):
+    index = None
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        params = dict((k, v[0]) for k, v in parse_qs(url.query).items())
+        query = url.path.strip('/')
+        if(query not in query_args):
+            self.reply(404, {'error': "Unknown query: " + query})
+            return
+        try:
+            result, ms = answer(self.index, query, [params[a] for a in query_args[query][0] if a in params])
+        except (KeyError, ValueError, IndexError) as e:
+            self.reply(400, {'error': str(e.args[0]) if e.args else str(e)})
+            return
+        self.reply(200, to_json(result))
+
+    def reply(self, code, body):
+        if(not isinstance(body, str)):
+            body = json.dumps(body)
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.end_headers()
+        self.wfile.write(body.encode('utf-8'))
+
+#serves queries on the index at path over http on localhost
+def serve(path, port):
+    QueryHandler.index = open_index(path)
+    server = HTTPServer(('127.0.0.1', port), QueryHandler)
+    printcov("Answering queries on: " + path + " at: http://127.0.0.1:" + str(port) + "/")
+    server.serve_forever()
+
+##### main #####
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Contact queries on a contact index.')
+    parser.add_argument('--index', default=index_path, metavar='PATH',
+        help='contact index folder (default: ' + index_path + ')')
+    parser.add_argument('--port', type=int, default=server_port,
+        help='port of the http server (default: ' + str(server_port) + ')')
+    parser.add_argument('query', choices=['contacts', 'exposure', 'hotspots', 'near', 'serve'])
+    parser.add_argument('args', nargs='*')
+    args = parser.parse_args()
+
+    if(args.query == 'serve'):
+        serve(args.index, args.port)
+        sys.exit(0)
+    started = time.time()
+    index = open_index(args.index)
+    opened = (time.time() - started) * 1000
+    try:
+        result, ms = answer(index, args.query, args.args)
+    except (KeyError, ValueError, IndexError) as e:
+        parser.error(str(e.args[0]) if e.args else str(e))
+    if(isinstance(result, pd.DataFrame)):
+        print(result.to_string(index=False))
+    else:
+        print(json.dumps(result, indent=1))
+    printcov("Opened index in: " + ('%.1f' % opened) + " ms, answered in: " + ('%.1f' % ms) + " ms.")
@@ -21,16 +21,34 @@ Dependencies:
 - networkx 2.2 ( !pip install networkx=2.2. 2.2 due to python 2.7 - use latest if on Python 3+ )
 - python-louvain 0.13 ( !pip install python-louvain )
 - matplotlib 2.2.4
+- numpy (comes with pandas)
 
 '''
 
 import pandas as pd
+import numpy as np
 import LatLon
 from LatLon import *
 import networkx as nx
 import matplotlib.pyplot as plt
 import time
-from copy import deepcopy
+import resource
+import os
+import re
+import ctypes
+import argparse
+import json
+import subprocess
+import sys
+import shutil
+import hashlib
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+from collections import OrderedDict, deque
+from multiprocessing import Pool
+from multiprocessing.sharedctypes import RawArray
 import community
 
 ##### All configurations start here #####
@@ -46,6 +64,181 @@ datapath = 'cov19_gen_dataset_05_doctored.csv' #'cov19_gen_dataset_10k.csv'
 #can be changed to anything, default is kept at x metres. This is for tagging high risk contacts.
 microcell_radius = 0.005 # e.g., say is set to 0.003. It is about 10 ft captured here in (3) metres
 
+#list of microcell radii (km) to evaluate in one run, e.g. [0.005, 0.01, 0.02]. [] = only
+#microcell_radius. The overlap pass runs once, with the largest radius, and every breach it
+#finds is replayed onto a separate biggx for each radius it falls within. Each radius gets a
+#folder microcell_radius_Rmetres in the current folder with its travel history, graph, dwell
+#index & analysis output, the same as a run with microcell_radius = R would give. Can also be
+#set with --radii R1,R2,...
+microcell_radii = []
+
+#selects how location pairs are found when looking for microcell breaches.
+#'brute' = compare every location of every person with every location of every other person.
+#          This also writes the full travel history (every pair, breached or not).
+#'grid'  = bucket all locations into a uniform lat/lon grid with cells as wide as the microcell
+#          radius and only compare locations in neighbouring cells. biggx, breaches and risk are
+#          identical to 'brute' but the travel history only holds the breached location pairs.
+#          Use this for large populations (e.g. the 1k and 2k datasets).
+#'sweep' = sort all locations by entry time and sweep through them to pair up only locations
+#          where two people were present at the same time, then check distance for those
+#          pairs only. Fastest when people rarely share the area at the same time. Only
+#          breaches with a time overlap are recorded, so biggx has fewer breach edges than
+#          with 'brute' but high risk contacts and infection start locations are identical.
+#'shard' = split the area into tiles (see shard_tiles) and run the 'grid' engine on each tile
+#          as a separate process (a shard) that only reads the locations in its tile plus a
+#          halo of microcell_radius around it. The shards' breaches are merged back into one
+#          travel history & biggx, identical to the 'grid' engine.
+overlap_engine = 'brute'
+
+#selects how the distance between two locations is calculated.
+#'latlon' = one LatLon.distance() call (pyproj, WGS84 ellipsoid) per pair of locations.
+#'numpy'  = vectorized Vincenty formula on the WGS84 ellipsoid. Calculates distances of one
+#           person's locations against a whole block of people in one call. Agrees with
+#           'latlon' to within distance_kernel_tolerance (see below) for city sized areas.
+distance_kernel = 'latlon'
+
+#1 = compare each pair of people only once (person i against person j for i < j) and mirror
+#    the results for j against i. Halves the work of the overlap pass. biggx is unchanged.
+#0 = compare every person against every other person in both directions.
+symmetric_pairs = 0
+
+#only used when symmetric_pairs = 1. 1 = expand the mirrored results back into the usual
+#layout of the travel history (rows for i against j as well as j against i, in the same order
+#as symmetric_pairs = 0) for consumers of travelhist_df.csv. 0 = only keep rows for i < j.
+expand_symmetric_rows = 1
+
+#what the travel history holds.
+#'full'   = every pair of locations compared by the 'brute' engine, breached or not.
+#'breach' = only pairs of locations that breached the microcell (this includes every high
+#           risk pair). Pairs without a breach are only counted. Memory & file size then grow
+#           with the number of contacts instead of the number of pairs. The 'grid' & 'sweep'
+#           engines always work this way.
+travel_hist_mode = 'full'
+
+#no of worker processes for the distance calculations of the overlap pass (any engine).
+#0 or 1 = everything runs in this process. Anything more starts a pool of worker processes
+#that read the dwell table from shared memory and send back distances for blocks of people
+#(or blocks of candidate pairs). Breaches are still applied to biggx by this process, in the
+#same order as the serial pass, so the results are identical. Needs the fork start method
+#(linux). Can also be set with --workers N on the command line.
+workers = 0
+
+#only used when workers > 1. 1 = after the overlap pass, runs it again in this process alone
+#and checks that the travel history & biggx come out identical (see test_pooled_overlaps).
+#Takes as long as a run without workers on top. Can also be set with --test-workers.
+test_workers = 0
+
+#only used when overlap_engine = 'shard'. The area is split into rows x columns tiles of
+#shard_box (lat start, lat end, lon start, lon end in degrees, the same box that generator.py
+#draws locations from). Locations outside of the box belong to the nearest edge tile.
+shard_tiles = [2, 2]
+shard_box = [18.565, 18.5655, 73.9071, 73.910999]
+
+#only used when overlap_engine = 'shard'. 1 = start all shards as local processes & wait for
+#them. 0 = don't start anything. The shards must already have been run, e.g. on other nodes
+#with 'python cov19_con_trace.py --shard K' for each tile K (0 .. rows x columns - 1), and
+#their output folders (shard_K) copied into the current folder. A shard needs the prepp'd
+#data (preppd_df) of the same data file.
+shard_launch = 1
+
+#incremental mode. A file of new location readings (same format as datapath) that is added
+#to the results of an earlier run in the current folder (graph.gz & the dwell index, see
+#dwell_index_path) instead of analysing datapath from scratch. Only the new readings are
+#compared, against the locations around them, and biggx is updated in place. Works like the
+#'grid' engine, so biggx ends up as a 'grid' (or 'brute') run on all readings would leave it
+#(with stable_time_sort = 1 if readings of a person share a time).
+#A person's new readings must not be earlier than their readings so far. The travel
+#history of the new readings is saved as travelhist_delta_df. Can also be set with
+#--delta PATH. '' = off.
+delta_path = ''
+
+#folder of the dwell index that every run saves for incremental mode. It holds the dwell
+#interval table in segments (one per run) sorted by spatial grid cell, and a table of people.
+dwell_index_path = 'dwell_index'
+
+#graph the louvain communities are found on (see find_communities_based_on_loc):
+#'locations' = all of biggx, every location of every person with its trajectory & breach edges.
+#'breaches'  = only the breached locations and their breach edges, weighted by the no of
+#              breaches between two locations. Far smaller than biggx, most of whose edges are
+#              trajectories. Locations without a breach are in no community.
+#'people'    = one node per person, two people joined by an edge weighted by the no of breaches
+#              between their locations. A community holds all locations of its people.
+#Can also be set with --communities.
+community_graph = 'locations'
+
+#seed of the louvain community detection, so that runs on the same graph find the same
+#communities. Can also be set with --community-seed. -1 = a different seed every run.
+community_seed = 1
+
+#file the communities of a run are saved to (in the current folder). Incremental runs (see
+#delta_path) start the community detection from the communities saved by the run before them,
+#if it used the same community_graph. New nodes start in a community of their own.
+communities_path = 'communities.json'
+
+#folder the contact index is saved to by every run, for contact_query.py. It holds every
+#person's locations (visits) with their contacts, the exposure of every person and the visits
+#of every spatial grid cell, as memory mapped columns (see save_contact_index).
+contact_index_path = 'contact_index'
+
+#how many contacts deep exposure is traced from the known infected people (see
+#trace_exposure). 1 = only the people who met a known infected person. Can also be set with
+#--exposure-depth.
+exposure_depth = 3
+
+#how dataprep sorts each person's readings by time when some of them have the same time.
+#0 = the default (quicksort) sort of pandas. Readings with the same time may change their
+#    order, as they always have, so prepp'd data & results stay the same as before.
+#1 = a stable sort, so readings with the same time keep their order in the data file.
+#    Incremental mode (see delta_path) always sorts this way, so set this to 1 for a full run
+#    that should give the same entry & exit times as a full run plus incremental runs.
+#Can also be set with --stable-sort.
+stable_time_sort = 0
+
+#no of rows of the data file read at a time by dataprep. 0 = read the whole file at once.
+#Anything else streams the file through in chunks of this many rows and writes each person's
+#prepp'd rows as soon as they are complete, so the file itself never has to fit in memory.
+#Streaming needs each person's rows to be together in the file, as generator.py writes them.
+ingest_chunksize = 0
+
+#format of the intermediate files (prepp'd data & travel history).
+#'csv' = preppd_df.csv & travelhist_df.csv in the current folder.
+#'npy' = folders preppd_df & travelhist_df in the current folder, holding one numpy .npy file
+#        per column. Columns are typed (int32 person ids, float64 lat/lon, int32 times and
+#        minute of day, coded condition/breach/risk) and are memory mapped when read back so
+#        nothing is reparsed. datapath can point to a preppd_df folder from an earlier run, or
+#        to a folder of raw readings in the same layout (generator.py with generation_format
+#        'npy'), which is prepp'd like a data file.
+storage_format = 'csv'
+
+#only used when storage_format = 'npy'. 1 = also export the folders to the usual csv files.
+export_csv = 0
+
+#folder of the artifact cache. Every full run saves its prepp'd data, dwell interval table,
+#travel history (the breached pairs) & biggx there, under a key made of the hash of the data
+#& the parameters that change them (microcell_radius, overlap_engine, distance_kernel,
+#travel_hist_mode, symmetric_pairs, expand_symmetric_rows & stable_time_sort). A later run with
+#the same key loads them and skips straight to the analysis. biggx is loaded in the order it
+#was built in, so the analysis is the same too. Incremental & multi radius runs don't use the
+#cache. Can also be set with --cache PATH.
+cache_path = 'artifact_cache'
+
+#size limit of the artifact cache (MB). When it grows beyond, the entries used least recently
+#are removed. Can also be set with --cache-max-mb. 0 = no cache.
+cache_max_mb = 1024
+
+#how much is printed.
+#'debug' = also the raw & prepp'd data, every graph and every location pair as it is processed.
+#          For large populations printing all that takes longer than the analysis itself.
+#'info'  = progress & timings of every stage, and the results.
+#Can also be set with --log-level.
+log_level = 'info'
+
+#file the metrics of the run are saved to as json: the wall time, cpu time & peak memory of
+#every stage (see timed_stage) and counters (see count_metric) of people, locations, location
+#pairs examined, breaches, high risk contacts, and nodes & edges of biggx. They are printed at
+#the end of the run either way. Can also be set with --metrics FILE. '' = not saved.
+metrics_path = ''
+
 #controls whether graphs are visually displayed or not. If running on linux ensure X Windows is available.
 #0 = graphs are displayed in ui. 1 = no graphs are displayed.
 ui = 1
@@ -72,6 +265,75 @@ biggx = nx.Graph()
 #list of known infected people
 known_infected_list = []
 
+#dwell interval table. One entry per recorded location (node) of every person, in the same
+#order as gxarry_pop_travel_hist. Built once from the per person parts that graph_per_person
+#collects in dwell_parts. Holds numpy arrays:
+# pid, node        : index of the person's graph & node id within that graph
+# lat, lon         : location of the node
+# entry, exit      : entry & exit time in the same form as the edge 'time' attribute (hhmm)
+# entmin, extmin   : entry & exit time as integer minutes of the day. Used for comparisons.
+# sick             : True if the person is sick
+#and offsets (person p's nodes are at offsets[p]:offsets[p+1]), pidof (name -> pid) and the
+#name & con(dition) of every person (lists, by pid).
+dwell_parts = []
+dwell_table = {}
+
+#time of the first reading (hhmm) of every person, by name. The dwell table has no entry time
+#for a person's first location (0), so the exposure trace & contact index take it from here
+#(see compact_dwell_times). Filled from the prepp'd data, or the dwell index in incremental mode.
+first_readings = {}
+
+#True when log_level is 'debug'. Checked before every print of the hot paths (per person,
+#per location pair) so that nothing is formatted unless it is printed.
+debug_output = False
+
+#wall time, cpu time & peak memory of every stage of the run (see timed_stage), in the order
+#the stages ran, and the counters of the run (see count_metric). Saved to metrics_path.
+stage_log = []
+metrics = OrderedDict()
+
+#breaches marked in biggx during the overlap pass, as (anchor node, anchor condition,
+#comparison node, comparison condition, time overlap, distance), in the order they were
+#marked. Only recorded when several microcell_radii are evaluated or for the artifact cache
+#(see cache_path). None = not recorded.
+breach_log = None
+
+#dwell table columns that overlap workers read. Placed in shared memory before the workers start.
+shared_dwell_columns = ['lat', 'lon', 'pid', 'node', 'offsets']
+
+#pool of overlap worker processes (see workers) and the LatLon object of every location in
+#the dwell table, built once by each worker from the shared lat/lon columns.
+overlap_pool = None
+dwell_locs = []
+
+#smallest radius of curvature of the WGS84 ellipsoid (km). Used to size spatial grid cells
+#so that no pair of locations within the microcell radius can be missed.
+earth_min_radius = 6335.4
+
+#spatial grid cells are made slightly larger than strictly needed to stay safe from rounding.
+grid_cell_margin = 1.01
+
+#cells of the dwell index grid are numbered cx * index_key_span + cy (see index_cell_keys)
+index_key_span = 2 ** 31
+
+#version of the layout of artifact cache entries. Part of every key, so entries saved in an
+#older layout are never loaded.
+cache_format = 3
+
+#file in the current folder holding the artifact key of the run that wrote the outputs there
+#(prepp'd data, travel history, dwell index & graph.gz) & their storage_format. A cache hit
+#only rewrites the outputs if they are not of the same key.
+output_stamp_path = 'artifact_key.txt'
+
+#WGS84 ellipsoid used by the 'numpy' distance kernel. Same as the LatLon default. a & b in km.
+wgs84_a = 6378.137
+wgs84_f = 1 / 298.257223563
+wgs84_b = wgs84_a * (1 - wgs84_f)
+
+#max difference (km) allowed between the 'numpy' distance kernel and LatLon.distance(). The
+#measured difference on the bundled datasets is below 1e-10 km (a tenth of a micrometre).
+distance_kernel_tolerance = 1e-9
+
 ##### Methods #####
 
 #customized printer
@@ -82,56 +344,270 @@ def printcov(str_to_print):
 #finding each unique person in the dataset, sorting the location records by time in an
 #ascending order and others.
 def dataprep():
-    rawdataframe = pd.read_csv(datapath, sep=',', header=0)
+    if(is_prepped_columns(datapath)):
+        return dataprep_columns()
+    if(ingest_chunksize > 0 and not os.path.isdir(datapath)):
+        return dataprep_streaming()
+
+    if(os.path.isdir(datapath)):
+        rawdataframe = columns_to_frame(*load_columns(datapath))
+    else:
+        rawdataframe = pd.read_csv(datapath, sep=',', header=0)
     
-    printcov("Sample of loaded raw data: ")
-    print(rawdataframe.head(3))
-    print(rawdataframe.tail(3))
+    if(debug_output):
+        printcov("Sample of loaded raw data: ")
+        print(rawdataframe.head(3))
+        print(rawdataframe.tail(3))
 
     popcount = 0
-    lastname = ""
-    dftmp = pd.DataFrame()
+    dfs = []
 
-    #our goal is to get each unique name and then prepare data for that.
-    for index, row in rawdataframe.iterrows():
-        currname = row['name']
-        if(currname != lastname):
+    #our goal is to get each unique name and then prepare data for that. groupby keeps
+    #the names in the order they first appear in and each person's rows in file order.
+    for currname, df in rawdataframe.groupby('name', sort=False):
+        if(debug_output):
             printcov("Processing for: " + currname)
-            persons.append(currname)
-            df = rawdataframe.loc[rawdataframe['name'] == currname]
             printcov("# of rows found: " + str(len(df)))
-            popcount = popcount + 1
+        persons.append(currname)
+        popcount = popcount + 1
 
-            #now to sort the rows by time. We ignore the Date field as we are assuming
-            #that the data is of a single day only.
-            df = df.sort_values(by=['time'])
-            
-            #finally append this to the sorted df
-            dftmp = dftmp.append(df)
-            lastname = currname
+        #now to sort the rows by time. We ignore the Date field as we are assuming
+        #that the data is of a single day only. See stable_time_sort for readings with the
+        #same time.
+        dfs.append(df.sort_values(by=['time'], kind=time_sort_kind()))
 
     printcov("Completed prep for data.")
-    #sorteddf = sorteddf.append(dftmp)
+    dftmp = pd.concat(dfs)
     dftmp = dftmp.reset_index(drop=True)
-    printcov("Prepp'd data: ")
-    print(dftmp.head(27))
-    print(dftmp.tail(27))
+    if(debug_output):
+        printcov("Prepp'd data: ")
+        print(dftmp.head(27))
+        print(dftmp.tail(27))
     printcov("Unique people found in pop of size: " + str(popcount))
-    print(persons)
-    printcov("Saving prepp'd data to a file: preppd_df.csv for debugging (in current folder).")
-    dftmp.to_csv("preppd_df.csv")
+    if(debug_output):
+        print(persons)
+    printcov("Saving prepp'd data to: preppd_df for debugging (in current folder).")
+    save_prepped(dftmp)
+
+    return dftmp
+
+#reads a data file in chunks of chunksize rows and yields (name, rows sorted by time) for
+#one person at a time, as soon as all of that person's rows have been read. Only one chunk
+#and one person's rows are held in memory. Each person's rows must be together in the file.
+def stream_prepped_persons(path, chunksize):
+    pending = None #rows of the last person of the previous chunk, who may continue
+    seen = set()
+    for chunk in pd.read_csv(path, sep=',', header=0, chunksize=chunksize):
+        if(pending is not None):
+            chunk = pd.concat([pending, chunk])
+        names = chunk['name'].values
+        #positions where a new person's rows start
+        starts = np.concatenate([[0], np.nonzero(names[1:] != names[:-1])[0] + 1])
+        for k in range(0, len(starts) - 1):
+            yield prep_one_person(chunk.iloc[starts[k]:starts[k+1]], seen)
+        pending = chunk.iloc[starts[-1]:]
+
+    if(pending is not None and len(pending) > 0):
+        yield prep_one_person(pending, seen)
+
+#sorts the rows of one person by time, the same way dataprep does.
+def prep_one_person(df, seen):
+    currname = df['name'].values[0]
+    if(currname in seen):
+        raise ValueError("Rows for: " + str(currname) + " are not together in the data file. "
+            "Set ingest_chunksize = 0 to read it in one go.")
+    seen.add(currname)
+    return currname, df.sort_values(by=['time'], kind=time_sort_kind())
+
+#sort used for each person's readings by dataprep (see stable_time_sort)
+def time_sort_kind():
+    if(stable_time_sort == 1):
+        return 'mergesort'
+    return 'quicksort'
+
+#same as dataprep but streams the data file through in chunks of ingest_chunksize rows and
+#appends each person's rows to preppd_df.csv as soon as they are ready.
+def dataprep_streaming():
+    printcov("Streaming raw data in chunks of: " + str(ingest_chunksize) + " rows.")
+    dfs = []
+    rowcount = 0
+    for currname, df in stream_prepped_persons(datapath, ingest_chunksize):
+        if(debug_output):
+            printcov("Processing for: " + currname)
+            printcov("# of rows found: " + str(len(df)))
+        persons.append(currname)
+        df = df.reset_index(drop=True)
+        df.index = df.index + rowcount
+        if(storage_format == 'csv'):
+            df.to_csv("preppd_df.csv", mode=('w' if rowcount == 0 else 'a'), header=(rowcount == 0))
+        rowcount = rowcount + len(df)
+        dfs.append(df)
+
+    dftmp = pd.concat(dfs)
+    if(storage_format != 'csv'):
+        save_prepped(dftmp)
+    printcov("Completed prep for data. Saved prepp'd data to: preppd_df (in current folder).")
+    printcov("Unique people found in pop of size: " + str(len(persons)))
+    if(debug_output):
+        print(persons)
 
     return dftmp
 
+#whether path is a folder of prepp'd data columns (see save_prepped, which adds the minute of
+#day) rather than a data file or a folder of raw readings
+def is_prepped_columns(path):
+    return os.path.isdir(path) and os.path.exists(column_file(path, 'minute'))
+
+#same as dataprep but for prepp'd data saved as columns (storage_format = 'npy') by an
+#earlier run. The data is already sorted so it is only memory mapped and decoded.
+def dataprep_columns():
+    printcov("Loading prepp'd data columns from: " + datapath)
+    cols, cats = load_columns(datapath)
+    dftmp = columns_to_frame(cols, cats)
+    persons.extend(cats['name'])
+    printcov("Unique people found in pop of size: " + str(len(persons)))
+    if(debug_output):
+        print(persons)
+    return dftmp
+
+#saves the prepp'd data in the configured storage_format
+def save_prepped(dftmp):
+    if(storage_format == 'npy'):
+        save_columns(dftmp, "preppd_df", {'name': persons},
+            {'minute': hhmm_to_minutes(dftmp['time'].values).astype(np.int32)})
+        if(export_csv == 1):
+            export_columns_to_csv("preppd_df", "preppd_df.csv")
+    else:
+        dftmp.to_csv("preppd_df.csv")
+    return
+
+#saves the travel history in the configured storage_format. LatLon objects are saved as
+#separate lat & lon columns. name is the file (or folder) name without extension. The index of
+#the travel history (all 0 for the 'brute' engine) is kept as the extra array 'index'.
+def save_travel_hist(th, name="travelhist_df"):
+    if(storage_format == 'npy'):
+        save_columns(travel_hist_columns(th), name, {'name1': persons, 'name2': persons},
+            {'index': np.asarray(th.index, dtype=np.int64)})
+        if(export_csv == 1):
+            export_columns_to_csv(name, name + ".csv")
+    else:
+        th.to_csv(name + ".csv")
+    return
+
+#the travel history with its LatLon columns as separate lat & lon columns, for save_columns
+def travel_hist_columns(th):
+    cols = th.drop(['latlon1','latlon2'], axis=1)
+    for n in ['1', '2']:
+        cols['lat' + n] = [loc.lat.decimal_degree for loc in th['latlon' + n]]
+        cols['lon' + n] = [loc.lon.decimal_degree for loc in th['latlon' + n]]
+    return cols
+
+#turns the columns of travel_hist_columns back into the travel history. One LatLon object is
+#made per distinct location and shared by all rows at it, as there are far fewer locations
+#than rows.
+def travel_hist_from_columns(df):
+    for n in ['1', '2']:
+        #lat & lon as one complex number, to find the distinct locations in one np.unique
+        locs, inverse = np.unique(df['lat' + n].values.astype(np.float64)
+            + 1j * df['lon' + n].values.astype(np.float64), return_inverse=True)
+        objs = [LatLon(Latitude(loc.real), Longitude(loc.imag)) for loc in locs.tolist()]
+        df['latlon' + n] = [objs[i] for i in inverse]
+    return df[col_breach]
+
+#file name used for a column in a columns folder
+def column_file(path, col):
+    return os.path.join(path, re.sub('[^A-Za-z0-9]+', '_', str(col)) + '.npy')
+
+#writes a dataframe as a folder of .npy files, one per column. Text columns are saved as
+#integer codes plus a file of their distinct values (categories), int32 codes when the
+#categories are given (e.g. the names of all persons, so codes are person ids) and int8 codes
+#otherwise if there are few enough distinct values. Integer columns are saved as int32. extra
+#holds additional arrays (e.g. derived columns) that are saved next to the columns.
+def save_columns(df, path, categories={}, extra={}):
+    if(not os.path.isdir(path)):
+        os.makedirs(path)
+    df = df.infer_objects() #columns built by appending rows are often plain objects
+    for col in df.columns:
+        values = df[col].values
+        if(values.dtype == object):
+            if(col in categories):
+                uniques = pd.Index(categories[col])
+                codes = uniques.get_indexer(values).astype(np.int32)
+            else:
+                codes, uniques = pd.factorize(values)
+                codes = codes.astype(np.int8 if len(uniques) < 128 else np.int32)
+            np.save(column_file(path, col), codes)
+            np.save(column_file(path, str(col) + '_categories'),
+                np.array([str(u) for u in uniques], dtype=np.string_))
+        elif(values.dtype.kind in 'iu'):
+            np.save(column_file(path, col), values.astype(np.int32))
+        else:
+            np.save(column_file(path, col), values.astype(np.float64))
+    for col in extra:
+        np.save(column_file(path, col), extra[col])
+    np.save(os.path.join(path, 'columns.npy'), np.array([str(c) for c in df.columns], dtype=np.string_))
+    printcov("Saved: " + str(len(df)) + " rows as columns in: " + path)
+    return
+
+#reads a folder written by save_columns. Columns are memory mapped so nothing is read till
+#used. Returns an ordered dict of column -> array (codes for text columns) & a dict of text
+#column -> list of categories. Extra arrays are not returned, use load_column for those.
+def load_columns(path):
+    cols = OrderedDict()
+    cats = {}
+    for col in np.load(os.path.join(path, 'columns.npy')):
+        col = as_str(col)
+        cols[col] = load_column(path, col)
+        catfile = column_file(path, col + '_categories')
+        if(os.path.exists(catfile)):
+            cats[col] = [as_str(c) for c in np.load(catfile)]
+    return cols, cats
+
+#text saved by numpy comes back as bytes on python 3
+def as_str(b):
+    if(isinstance(b, str)):
+        return b
+    return b.decode()
+
+#memory maps one column (or extra array) of a columns folder
+def load_column(path, col):
+    return np.load(column_file(path, col), mmap_mode='r')
+
+#turns columns read by load_columns back into a dataframe, with text columns decoded. The
+#column order of the original dataframe is kept.
+def columns_to_frame(cols, cats):
+    df = pd.DataFrame(index=np.arange(len(next(iter(cols.values()))) if cols else 0))
+    for col in cols:
+        if(col in cats):
+            df[col] = np.array(cats[col], dtype=object)[np.asarray(cols[col])]
+        else:
+            df[col] = np.asarray(cols[col])
+    return df
+
+#exports a columns folder to a csv file with the same layout as the csv storage format. The
+#travel history's lat & lon columns are turned back into LatLon columns, and rows get the
+#index saved with them (see save_travel_hist), if any.
+def export_columns_to_csv(path, csvpath):
+    cols, cats = load_columns(path)
+    df = columns_to_frame(cols, cats)
+    if('lat1' in df.columns):
+        df = travel_hist_from_columns(df)
+    if(os.path.exists(column_file(path, 'index'))):
+        df.index = np.asarray(load_column(path, 'index'))
+    df.to_csv(csvpath)
+    printcov("Exported: " + path + " to: " + csvpath)
+    return
+
 #prepares graph data per unique person in the provided dataset and plots their travel
 #history with locations and time. Also generates and adds useful attributes to nodes 
 #and edges that help in further analysis. At this point, we know the total population
 #size, the names of each unique person. We use this to plot a graph for analysis.
 def graph_per_person(person):
-    printcov("Generating graph for: " + person)
     one_persons_records = sorteddf.loc[sorteddf['name'] == person] #sorted by time in asc order
     one_persons_records = one_persons_records.reset_index(drop=True)
-    print(one_persons_records)
+    if(debug_output):
+        printcov("Generating graph for: " + person)
+        print(one_persons_records)
     gx = nx.MultiDiGraph(name=person,con=one_persons_records['condition'][0]) #new graph for curr person
 
     #create all nodes
@@ -145,12 +621,14 @@ def graph_per_person(person):
     noofnodes = nx.number_of_nodes(gx)
 
     #now let's add edges for the nodes
-    print("Adding edges for: " + str(nx.number_of_nodes(gx)) + " nodes...")
-    print(gx.nodes())
+    if(debug_output):
+        print("Adding edges for: " + str(nx.number_of_nodes(gx)) + " nodes...")
+        print(gx.nodes())
     for x in range(0,noofnodes):
         y = x + 1
         if(y == noofnodes):
-            print("reached end node")
+            if(debug_output):
+                print("reached end node")
             break
         else:
             nodelabel1 = str(person) + str(x)
@@ -158,7 +636,17 @@ def graph_per_person(person):
             #gx.add_edge(nodelabel1,nodelabel2,time=one_persons_records.at[nodelabel2,'time'])
             gx.add_edge(nodelabel1,nodelabel2,time=one_persons_records['time'][y])
 
-    print("Completed adding edges for: " + str(person) + ". Graph complete.")
+    if(debug_output):
+        print("Completed adding edges for: " + str(person) + ". Graph complete.")
+
+    #entry time of a node is the time on its incoming edge & exit time is the time on its
+    #outgoing edge. The first node has no entry time and the last node no exit time (0).
+    times = list(one_persons_records['time'])
+    nodeattrib = nx.get_node_attributes(gx,'latlon')
+    dwell_parts.append({'name': person, 'con': one_persons_records['condition'][0],
+        'lat': [nodeattrib[str(person) + str(n)].lat.decimal_degree for n in range(0, noofnodes)],
+        'lon': [nodeattrib[str(person) + str(n)].lon.decimal_degree for n in range(0, noofnodes)],
+        'entry': [0] + times[1:], 'exit': times[1:] + [0]})
 
     disp_graph(gx)
     gxarry_pop_travel_hist.append(gx)
@@ -170,114 +658,482 @@ def graph_per_person(person):
 #create a new undirected graph that has all overlaps available. There shall be one
 #such overlap graph per person in the population.
 def overlaps_for_pop(gxall):
+    if(overlap_engine == 'grid'):
+        return overlaps_for_pop_grid(gxall)
+    if(overlap_engine == 'sweep'):
+        return overlaps_for_pop_sweep(gxall)
+    if(overlap_engine == 'shard'):
+        return overlaps_for_pop_sharded(gxall)
+
     printcov("Finding overlaps within population's location history")
-    b_all = pd.DataFrame(columns = col_breach)
+    buf = new_travel_hist_buffer()
+    pairs = 0 #location pairs compared, as laid out in the travel history
+    offsets = dwell_table['offsets']
+    bands = None
+    if(overlap_pool is not None):
+        bands = pool_anchor_distances(overlap_pool, len(gxall))
+    printcov("Peak memory before overlap pass: " + str(peak_memory_mb()) + " MB")
+    undgxall = build_undirected_graphs(gxall)
+    mirrored = {} #symmetric mode: rows of (i,j) kept till they are mirrored for (j,i)
     for x in range(0, len(gxall)):
         #get the 1st person and find overlaps of each of their loc
         #with each loc of each other person in the population.
         
-        #we convert the graph to an undirected copy since mixed graphs are
+        #we use the undirected version of the graphs since mixed graphs are
         #not possible in nx. We'll use both versions for later analysis. Note
         #that the loc overlap calc doesnt need undirected graph. We shall create
         #a new undirected edge for each overlap and that is why we need to
-        #convert to undirected graph
-        undirectedgxcurr = gxall[x].to_undirected() #get this person's graph
-        
+        #convert to undirected graph. The undirected graphs are built only once
+        #and shared (read only) by all comparisons.
+        undirectedgxcurr = undgxall[x] #get this person's graph
+
+        #with the numpy kernel (or overlap workers) all distances of this person against
+        #everyone else are calculated in one go. Each comparison then gets its own slice of
+        #the matrix. In symmetric mode only the people after this one are needed.
+        distmatrix = None
+        if(bands is not None):
+            base, distmatrix = next(bands)
+        elif(distance_kernel == 'numpy'):
+            base = anchor_base(x)
+            distmatrix = anchor_distances(x, base)
+
         #compare current person graph with all others for loc overlaps
-        #first copy out the graph container
-        gxallminuscurr = []
-        for cv in range(0,len(gxall)):
-            newgx = deepcopy(gxall[cv]) #use a deep copy
-            gxallminuscurr.append(newgx)
-
-        gxallminuscurr.pop(x)#remove current persons graph before cmp
-        for y in range(0, len(gxallminuscurr)):
-            undirectedgxnext = gxallminuscurr[y].to_undirected()
+        for y in range(0, len(undgxall)):
+            if(y == x):
+                continue
+            if(symmetric_pairs == 1 and y < x):
+                #already compared when y was the anchor. Only the rows are needed.
+                if(expand_symmetric_rows == 1):
+                    add_travel_hist_rows(buf, mirror_overlap_rows(mirrored.pop((y,x))))
+                    pairs = pairs + len(undirectedgxcurr) * len(undgxall[y])
+                continue
+            undirectedgxnext = undgxall[y]
             disp_graph(undirectedgxnext)
-            bxy = find_overlap(undirectedgxcurr,undirectedgxnext)
-            b_all = b_all.append(bxy)
+            distances = None
+            if(distmatrix is not None):
+                distances = distmatrix[:, offsets[y]-base:offsets[y+1]-base]
+            bxy = find_overlap(undirectedgxcurr,undirectedgxnext,distances,symmetric_pairs == 1)
+            add_travel_hist_rows(buf, bxy)
+            pairs = pairs + len(undirectedgxcurr) * len(undirectedgxnext)
+            if(symmetric_pairs == 1 and expand_symmetric_rows == 1):
+                mirrored[(x,y)] = bxy
             
+    b_all = travel_hist_frame(buf)
+    printcov("Peak memory after overlap pass: " + str(peak_memory_mb()) + " MB")
     printcov("Completed overlap extractions.")
+    summarize_travel_hist(b_all, pairs)
     return b_all
 
-#finds overlapping locations between two graphs
-def find_overlap(undgx_curr, undgx_next):
+#first location (offset into the dwell table) that person x is compared against in one go
+def anchor_base(x):
+    if(symmetric_pairs == 1):
+        return dwell_table['offsets'][x+1]
+    return 0
+
+#distances (km) of every location of person x (rows) against every location in the dwell
+#table from base onwards (columns). With the 'latlon' kernel the LatLon objects in dwell_locs
+#are used and x's own locations are left at 0.
+def anchor_distances(x, base):
+    lats = dwell_table['lat']
+    lons = dwell_table['lon']
+    offsets = dwell_table['offsets']
+    anchor = slice(offsets[x], offsets[x+1])
+    if(distance_kernel == 'numpy'):
+        return vincenty_distance(lats[anchor][:, None], lons[anchor][:, None],
+            lats[None, base:], lons[None, base:])
+
+    d = np.zeros((offsets[x+1] - offsets[x], len(lats) - base))
+    for i in range(offsets[x], offsets[x+1]):
+        for k in range(base, len(lats)):
+            if(dwell_table['pid'][k] != x):
+                d[i - offsets[x]][k - base] = dwell_locs[i].distance(dwell_locs[k])
+    return d
+
+#distances (km) of candidate location pairs (u,v) (index arrays into the dwell table) in both
+#directions, u to v and v to u. locs holds the LatLon object of every location for the
+#'latlon' kernel. The 'numpy' kernel & symmetric mode calculate one direction only.
+def candidate_distances(u, v, locs):
+    if(distance_kernel == 'numpy'):
+        lats = dwell_table['lat']
+        lons = dwell_table['lon']
+        d = vincenty_distance(lats[u], lons[u], lats[v], lons[v])
+        return d, d
+    fwd = np.array([locs[u[k]].distance(locs[v[k]]) for k in range(0, len(u))], dtype=np.float64)
+    if(symmetric_pairs == 1):
+        return fwd, fwd
+    bwd = np.array([locs[v[k]].distance(locs[u[k]]) for k in range(0, len(u))], dtype=np.float64)
+    return fwd, bwd
+
+#LatLon objects of every location in the dwell table, taken from the person graphs
+def graph_locs(gxall):
+    locs = []
+    for g in gxall:
+        nodeattrib = nx.get_node_attributes(g,'latlon')
+        for n in range(0, len(g)):
+            locs.append(nodeattrib[str(g.graph['name']) + str(n)])
+    return locs
+
+#moves the dwell table columns that overlap workers read into shared memory. Workers are
+#forked after this, so they map the same memory instead of getting a pickled copy.
+def share_dwell_table(table):
+    for col in shared_dwell_columns:
+        a = table[col]
+        raw = RawArray(ctypes.c_char, max(a.nbytes, a.itemsize))
+        shared = np.frombuffer(raw, dtype=a.dtype, count=len(a))
+        shared[:] = a
+        table[col] = shared
+    return
+
+#starts the overlap worker processes. Needs the dwell table to be built.
+def start_overlap_pool():
+    share_dwell_table(dwell_table)
+    printcov("Starting: " + str(workers) + " overlap worker processes.")
+    return Pool(workers, initializer = init_overlap_worker)
+
+#runs once in each overlap worker process
+def init_overlap_worker():
+    if(distance_kernel == 'latlon'):
+        dwell_locs[:] = [LatLon(Latitude(lat), Longitude(lon))
+            for lat, lon in zip(dwell_table['lat'], dwell_table['lon'])]
+    return
+
+#runs one block of the overlap pass in a worker process. A task is either
+#('anchors', lo, hi): (base, distances) of each person lo..hi-1, see anchor_distances
+#('pairs', u, v)    : distances of candidate location pairs, see candidate_distances
+def overlap_worker(task):
+    if(task[0] == 'anchors'):
+        return [(anchor_base(x), anchor_distances(x, anchor_base(x))) for x in range(task[1], task[2])]
+    return candidate_distances(task[1], task[2], dwell_locs)
+
+#yields (base, distances) for every person, in order, with the work spread over the pool in
+#blocks of people. Only a few blocks are in flight at a time to bound memory.
+def pool_anchor_distances(pool, n):
+    size = max(1, n // (workers * 4))
+    pending = deque()
+    for lo in range(0, n, size):
+        pending.append(pool.apply_async(overlap_worker, (('anchors', lo, min(lo + size, n)),)))
+        if(len(pending) >= workers * 2):
+            for band in pending.popleft().get():
+                yield band
+    while(len(pending) > 0):
+        for band in pending.popleft().get():
+            yield band
+
+#distances of candidate location pairs (u,v) in both directions, spread over the pool in
+#blocks of pairs.
+def pool_candidate_distances(pool, u, v):
+    size = max(1, -(-len(u) // (workers * 4)))
+    parts = pool.map(overlap_worker, [('pairs', u[lo:lo+size], v[lo:lo+size])
+        for lo in range(0, len(u), size)])
+    if(len(parts) == 0):
+        return candidate_distances(u, v, [])
+    return np.concatenate([p[0] for p in parts]), np.concatenate([p[1] for p in parts])
+
+#validates the overlap workers against this process. The first person's distances from a
+#worker must be exactly the ones the serial pass calculates, for both kinds of tasks.
+def test_overlap_pool(pool, gxall):
+    printcov("=========> Testing overlap workers: ")
+    base, band = pool.apply(overlap_worker, (('anchors', 0, 1),))[0]
+    assert base == anchor_base(0), "overlap worker used base " + str(base)
+    u, v = np.nonzero(np.ones(band.shape, dtype=bool))
+    v = v + base
+    keep = dwell_table['pid'][v] != 0
+    u = u[keep]
+    v = v[keep]
+    fwd, bwd = candidate_distances(u, v, graph_locs(gxall))
+    if(distance_kernel == 'numpy'):
+        assert np.array_equal(band, anchor_distances(0, base)), "overlap worker distances differ"
+    else:
+        assert np.array_equal(band[u, v - base], fwd), "overlap worker distances differ"
+    pfwd, pbwd = pool.apply(overlap_worker, (('pairs', u, v),))
+    assert np.array_equal(pfwd, fwd) and np.array_equal(pbwd, bwd), "overlap worker pair distances differ"
+    printcov("Overlap workers agree with this process on: " + str(len(u)) + " location pairs.")
+    printcov("=========> Testing complete.")
+    return
+
+#validates a pooled overlap pass against the serial path. The pass is run again in this
+#process alone, on base (biggx as it was before the pass), and the travel history, breach log
+#(if recorded) and all nodes & edges of biggx with their attributes must be identical to those
+#of the pooled pass, th & biggx. biggx, the breach log & the counters of the pooled pass are
+#kept.
+def test_pooled_overlaps(gxall, th, base):
+    global biggx, overlap_pool, breach_log
+    printcov("=========> Testing pooled overlap pass against the serial pass: ")
+    pooled, pool, log, counters = biggx, overlap_pool, breach_log, OrderedDict(metrics)
+    biggx = base
+    overlap_pool = None
+    if(log is not None):
+        breach_log = []
+    serial = overlaps_for_pop(gxall)
+    assert list(serial.index) == list(th.index), "travel history index differs"
+    assert travel_hist_columns(serial).equals(travel_hist_columns(th)), "travel history differs"
+    assert breach_log == log, "breach log differs"
+    assert sorted(biggx.nodes(data=True)) == sorted(pooled.nodes(data=True)), "biggx nodes differ"
+    edges = lambda gx: sorted((tuple(sorted((x, y))), key, sorted(attrs.items()))
+        for x, y, key, attrs in gx.edges(keys=True, data=True))
+    assert edges(biggx) == edges(pooled), "biggx edges differ"
+    printcov("Pooled & serial pass agree on: " + str(len(th)) + " travel history rows and: "
+        + str(pooled.number_of_edges()) + " edges.")
+    biggx, overlap_pool, breach_log = pooled, pool, log
+    metrics.clear()
+    metrics.update(counters)
+    printcov("=========> Testing complete.")
+    return
+
+#column buffers for travel history rows. Rows are added column by column to plain lists and
+#turned into a dataframe once, at the end of the overlap pass.
+def new_travel_hist_buffer():
+    return OrderedDict((c, []) for c in col_breach)
+
+#adds rows, as returned by find_overlap, to travel history column buffers
+def add_travel_hist_rows(buf, rows):
+    cols = list(buf.values())
+    for (x, y, row) in rows:
+        for c in range(0, len(cols)):
+            cols[c].append(row[c])
+    return
+
+#turns travel history column buffers into a dataframe. Every row gets index 0, just like
+#the one row dataframes the travel history used to be appended from.
+def travel_hist_frame(buf):
+    return pd.DataFrame(buf, columns = col_breach, index = [0] * len(buf[col_breach[0]]))
+
+#prints a summary of a travel history & counts it in metrics. pairs is the no of location
+#pairs (of different people) that the travel history stands for, whether they were kept as
+#rows or not.
+def summarize_travel_hist(th, pairs):
+    breaches = (th['breach'] == 'yes').sum()
+    high = (th['risk'] == 'high').sum()
+    metrics['location_pairs'] = int(pairs)
+    metrics['breaches'] = int(breaches)
+    metrics['high_risk'] = int(high)
+    printcov("Travel history covers: " + str(pairs) + " location pairs. Breaches: "
+        + str(breaches) + " (high risk: " + str(high) + "). Pairs without a breach: "
+        + str(pairs - breaches) + ", of which: " + str(len(th) - breaches) + " kept as rows.")
+    return
+
+#materializes the undirected form of every person's travel history graph once. The graphs
+#are frozen because every comparison in the overlap pass shares them.
+def build_undirected_graphs(gxall):
+    del undir_gxarray_pop_travel_hist[:]
+    for gx in gxall:
+        undir_gxarray_pop_travel_hist.append(nx.freeze(gx.to_undirected()))
+    return undir_gxarray_pop_travel_hist
+
+#peak resident memory of this process so far, in MB (ru_maxrss is in KB on linux)
+def peak_memory_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+#runs fn(*args) as one stage of the run and records its wall time, the cpu time of this
+#process (not of overlap workers or shards) & the peak memory of this process by its end in
+#stage_log. Returns what fn returns.
+def timed_stage(name, fn, *args):
+    started = time.time()
+    cpustart = sum(os.times()[0:2])
+    result = fn(*args)
+    stage = OrderedDict([('stage', name), ('secs', time.time() - started),
+        ('cpu_secs', sum(os.times()[0:2]) - cpustart), ('peak_mb', peak_memory_mb())])
+    stage_log.append(stage)
+    printcov("Stage: " + name + " took: " + ('%.3f' % stage['secs']) + " s (cpu: "
+        + ('%.3f' % stage['cpu_secs']) + " s). Peak memory: " + str(stage['peak_mb']) + " MB")
+    save_metrics()
+    return result
+
+#adds n to a counter of the run. Counters are kept in metrics.
+def count_metric(name, n):
+    metrics[name] = metrics.get(name, 0) + int(n)
+    return
+
+#prints the counters of the run as one line of json & saves the metrics of the run
+def print_metrics():
+    printcov("Metrics: " + json.dumps(metrics))
+    save_metrics()
+    return
+
+#saves the stages & counters of the run with its configuration to metrics_path as json
+def save_metrics():
+    if(metrics_path == ''):
+        return
+    f = open(metrics_path, 'w')
+    json.dump(OrderedDict([('datapath', datapath), ('microcell_radius', microcell_radius),
+        ('microcell_radii', microcell_radii), ('overlap_engine', overlap_engine),
+        ('distance_kernel', distance_kernel), ('workers', workers), ('people', len(persons)),
+        ('stages', stage_log), ('counters', metrics)]), f, indent=1)
+    f.close()
+    return
+
+#turns the rows found for an anchor against a comparison graph into the rows that the
+#comparison against the anchor would have given, in the same order.
+def mirror_overlap_rows(b):
+    return sorted([(y, x, row[5:10] + row[0:5] + row[10:]) for (x, y, row) in b])
+
+#finds overlapping locations between two graphs. distances is an optional precalculated
+#matrix of distances (km) between the nodes of both graphs, as given by the 'numpy' kernel.
+#mirror also marks every breach in biggx as seen from the comparison graph, which is
+#what comparing the two graphs the other way round would have done. Returns the travel
+#history rows as (anchor node, comparison node, row) tuples.
+def find_overlap(undgx_curr, undgx_next, distances=None, mirror=False):
     #get 'latlon' attributes of both and figure out if present in microcell
     anchorgraph_name = str(undgx_curr.graph['name'])
     compargraph_name = str(undgx_next.graph['name'])
     anchor_health_status = str(undgx_curr.graph['con'])
     compar_health_status = str(undgx_next.graph['con'])
-    printcov("Processing overlaps. Anchor graph: " + anchorgraph_name + " | " + 
-        anchor_health_status + " and Comparison graph: " 
-        + compargraph_name + " | " + compar_health_status)
     gxcurr_nodeattrib = nx.get_node_attributes(undgx_curr,'latlon')
     gxnext_nodeattrib = nx.get_node_attributes(undgx_next,'latlon')
-    printcov("Node attributes for overlap calc are:\n")
-    print("curr anchor graph: " + str(gxcurr_nodeattrib))
-    print("comparison  graph: " + str(gxnext_nodeattrib))
-    print("\n")
-
-    b = pd.DataFrame(columns = col_breach)
+    if(debug_output):
+        printcov("Processing overlaps. Anchor graph: " + anchorgraph_name + " | " + 
+            anchor_health_status + " and Comparison graph: " 
+            + compargraph_name + " | " + compar_health_status)
+        printcov("Node attributes for overlap calc are:\n")
+        print("curr anchor graph: " + str(gxcurr_nodeattrib))
+        print("comparison  graph: " + str(gxnext_nodeattrib))
+        print("\n")
+    #a mirrored comparison also stands for the comparison the other way round
+    count_metric('pairs_examined', len(gxcurr_nodeattrib) * len(gxnext_nodeattrib) * (2 if mirror else 1))
+
+    b = []
+    found = [] #breaches of this comparison, marked in biggx in one go (see add_breaches)
+    hits = [] #rows of b that breached, in the order of found
+
+    #entry & exit times of both graphs' nodes come from the dwell interval table. The
+    #time overlap of every pair of nodes is found in one go.
+    o1 = dwell_table['offsets'][dwell_table['pidof'][anchorgraph_name]]
+    o2 = dwell_table['offsets'][dwell_table['pidof'][compargraph_name]]
+    nodes1 = np.arange(o1, o1 + len(gxcurr_nodeattrib))
+    nodes2 = np.arange(o2, o2 + len(gxnext_nodeattrib))
+    timeoverlap = dwell_overlap(nodes1[:, None], nodes2[None, :])
 
     for x in range(0, len(gxcurr_nodeattrib)):
         for y in range(0, len(gxnext_nodeattrib)):
             #here, we compare curr(latlon) with next(latlon) iteratively.
             gxcurr_curr_nodelbl = str(anchorgraph_name) + str(x)
             gxnext_curr_nodelbl = str(compargraph_name) + str(y)
-            print(str(gxcurr_nodeattrib[gxcurr_curr_nodelbl]) + " ----- " + str(gxnext_nodeattrib[gxnext_curr_nodelbl]))
-            distance = gxcurr_nodeattrib[gxcurr_curr_nodelbl].distance(gxnext_nodeattrib[gxnext_curr_nodelbl])
-            print("Person: " + anchorgraph_name +  " & Person " + compargraph_name)
-            print("     - anchor node: " + str(gxcurr_curr_nodelbl) + "  and comparison node: " + str(gxnext_curr_nodelbl))
-            print("     - distance between above two: " + str(distance))
-
-            entm1 = find_startime_gx(x, undgx_curr, anchorgraph_name)
-            extm1 = find_endtime_gx(x, undgx_curr, anchorgraph_name)
-
-            entm2 = find_startime_gx(y, undgx_next, compargraph_name)
-            extm2 = find_endtime_gx(y, undgx_next, compargraph_name)
+            if(distances is None):
+                distance = gxcurr_nodeattrib[gxcurr_curr_nodelbl].distance(gxnext_nodeattrib[gxnext_curr_nodelbl])
+            else:
+                distance = distances[x][y]
+            if(debug_output):
+                print(str(gxcurr_nodeattrib[gxcurr_curr_nodelbl]) + " ----- " + str(gxnext_nodeattrib[gxnext_curr_nodelbl]))
+                print("Person: " + anchorgraph_name +  " & Person " + compargraph_name)
+                print("     - anchor node: " + str(gxcurr_curr_nodelbl) + "  and comparison node: " + str(gxnext_curr_nodelbl))
+                print("     - distance between above two: " + str(distance))
+
+            entm1 = dwell_table['entry'][o1+x]
+            extm1 = dwell_table['exit'][o1+x]
+
+            entm2 = dwell_table['entry'][o2+y]
+            extm2 = dwell_table['exit'][o2+y]
             
             risk = 'none'
             breach = 'no'
             if(distance <= microcell_radius):
-                
-                #a new edge connecting these two nodes and save the graph. Also mark
-                #the relevant loc's as 'breached' with a new node attribute. risk is still
-                #classified as none because we have not yet calculated time overlap
-                print("Microcell radius breached.")
                 breach = 'yes'
-                #breachnodes attribute is useful to find edges that caused a breach
-                biggx.add_edge(gxcurr_curr_nodelbl,gxnext_curr_nodelbl,
-                    breachnodes=(gxcurr_curr_nodelbl+':'+gxnext_curr_nodelbl))
-                biggx.nodes[gxcurr_curr_nodelbl]['breached'] = 'yes'
-                biggx.nodes[gxnext_curr_nodelbl]['breached'] = 'yes'
-
-                #time overlaps. use e*tm1 and e*tm2 to calculate overlap. If there is
-                #an overlap of time then we have two people in the same location at the same
-                #time => risk == high if one of them is sick. For the h person mark the loc as
-                #infection start time (potentially). We already have the time at that place tho
-                #the actual start time should be the time h and s were together first at this loc.
-                #risk = 'high'
-                if(max(entm1,entm2) <= min(extm1,extm2)):
-                    print("Time overlap found too. Checking if one of them is sick..")
-                    if( (anchor_health_status=='sick') or (compar_health_status=='sick')):
-                        print("One person is sick. Marked as high risk for healthy.")
-                        risk = 'high'
-                        if(anchor_health_status=='healthy'):
-                          biggx.nodes[gxcurr_curr_nodelbl]['infec_start_loc'] = 'yes'
-                        if(compar_health_status=='healthy'):
-                          biggx.nodes[gxnext_curr_nodelbl]['infec_start_loc'] = 'yes'
+                found.append((gxcurr_curr_nodelbl, anchor_health_status,
+                    gxnext_curr_nodelbl, compar_health_status, timeoverlap[x][y], distance))
+                if(mirror):
+                    found.append((gxnext_curr_nodelbl, compar_health_status,
+                        gxcurr_curr_nodelbl, anchor_health_status, timeoverlap[x][y], distance))
+                hits.append(len(b))
             
-            data = pd.DataFrame([[anchorgraph_name, anchor_health_status, 
+            if(breach == 'no' and travel_hist_mode == 'breach'):
+                continue
+            b.append((x, y, [anchorgraph_name, anchor_health_status, 
                     gxcurr_nodeattrib[gxcurr_curr_nodelbl], entm1, extm1, 
                     compargraph_name, compar_health_status,
                     gxnext_nodeattrib[gxnext_curr_nodelbl], entm2, extm2, 
-                    distance, breach, risk]],
-                    columns=['name1','con1','latlon1','entrytm1','exittm1','name2','con2',
-                        'latlon2','entrytm2','exittm2','dist','breach', 'risk'])
-            b = b.append(data)
+                    distance, breach, risk]))
 
+    #the risk of a breached row is that of its breach as seen from the anchor
+    risks = add_breaches(found)
+    step = 2 if mirror else 1
+    for n in range(0, len(hits)):
+        b[hits[n]][2][12] = risks[n * step]
     return b
 
+#marks a microcell breach between an anchor location node and a comparison location node
+#in biggx. timeoverlap tells if both people were at their locations at the same time (see
+#dwell_overlap) and distance is how far apart the locations are (km). Returns the risk for
+#this pair of locations, 'high' if there was a time overlap and one of them is sick, 'none'
+#otherwise.
+def mark_breach(anchor_nodelbl, anchor_health_status, compar_nodelbl, compar_health_status,
+    timeoverlap, distance):
+    return add_breaches([(anchor_nodelbl, anchor_health_status, compar_nodelbl,
+        compar_health_status, timeoverlap, distance)])[0]
+
+#marks many microcell breaches in biggx at once, as mark_breach does for one. breaches is a
+#list of (anchor node, anchor health status, comparison node, comparison health status,
+#timeoverlap, distance). All breach edges are added in one pass, in the order given, so
+#biggx ends up exactly as marking them one by one leaves it. Returns the risk of each breach.
+def add_breaches(breaches):
+    if(breach_log is not None):
+        breach_log.extend(breaches)
+    #a new edge connecting each pair of nodes. Also mark the relevant loc's as 'breached'
+    #with a new node attribute. breachnodes attribute is useful to find edges that caused
+    #a breach
+    biggx.add_edges_from([(br[0], br[2], {'breachnodes': br[0] + ':' + br[2]}) for br in breaches])
+    nodes = biggx.nodes
+    risks = []
+    for (anchor_nodelbl, anchor_health_status, compar_nodelbl, compar_health_status,
+        timeoverlap, distance) in breaches:
+        if(debug_output):
+            print("Microcell radius breached.")
+        nodes[anchor_nodelbl]['breached'] = 'yes'
+        nodes[compar_nodelbl]['breached'] = 'yes'
+        risks.append(mark_time_overlap(anchor_nodelbl, anchor_health_status, compar_nodelbl,
+            compar_health_status, timeoverlap))
+    return risks
+
+#marks the infection start locations in biggx for a pair of location nodes that breached the
+#microcell. Returns the risk, as for mark_breach.
+def mark_time_overlap(anchor_nodelbl, anchor_health_status, compar_nodelbl, compar_health_status,
+    timeoverlap):
+    risk = 'none'
+    #time overlaps. e*tm1 and e*tm2 are used to calculate overlap. If there is
+    #an overlap of time then we have two people in the same location at the same
+    #time => risk == high if one of them is sick. For the h person mark the loc as
+    #infection start time (potentially). We already have the time at that place tho
+    #the actual start time should be the time h and s were together first at this loc.
+    #risk = 'high'
+    if(timeoverlap):
+        if(debug_output):
+            print("Time overlap found too. Checking if one of them is sick..")
+        if( (anchor_health_status=='sick') or (compar_health_status=='sick')):
+            if(debug_output):
+                print("One person is sick. Marked as high risk for healthy.")
+            risk = 'high'
+            if(anchor_health_status=='healthy'):
+              biggx.nodes[anchor_nodelbl]['infec_start_loc'] = 'yes'
+            if(compar_health_status=='healthy'):
+              biggx.nodes[compar_nodelbl]['infec_start_loc'] = 'yes'
+
+    return risk
+
+#marks the breaches of log (see breach_log) that lie within radius (km) in biggx, in the
+#order they were logged. That is the order a pass with this radius marks them in, so biggx
+#ends up as that pass leaves it. Returns the no of breaches marked.
+def replay_breaches(log, radius):
+    return len(add_breaches([br for br in log if br[5] <= radius]))
+
+#travel history that a pass with a microcell radius of radius (km) gives, from the travel
+#history th of a pass with a larger radius. Breached rows further apart than radius are
+#dropped, or kept as rows without a breach if the travel history holds those too (see
+#travel_hist_mode). The risk of a breach doesn't depend on the radius.
+def travel_hist_for_radius(th, radius):
+    far = ((th['breach'] == 'yes') & (th['dist'] > radius)).values
+    if(overlap_engine == 'brute' and travel_hist_mode == 'full'):
+        th = th.copy()
+        th.loc[far, 'breach'] = 'no'
+        th.loc[far, 'risk'] = 'none'
+        return th
+    kept = th[~far]
+    #rows are labelled like the travel history of such a pass: 0, 1, .. or all 0 (brute)
+    kept.index = th.index[:len(kept)]
+    return kept
+
+#output folder of one of the microcell_radii, named like the dataset folders of this repo
+def radius_folder(radius):
+    return "microcell_radius_" + str(radius) + "metres"
+
 #finds the exit time for the given graph's node. exit time = time when the person exited a recorded loc
 def find_endtime_gx(nodelabelsuffix, gx, nodelabelprefix):
     curr_node = str(nodelabelprefix) + str(nodelabelsuffix)
@@ -324,7 +1180,677 @@ def find_startime_gx(nodelabelsuffix, gx, nodelabelprefix):
     
     return entm1
 
-#allows to validate all graphs. For each graph, walks it, explodes nodes and edges.
+#converts times of the form hhmm (e.g. 1816) into minutes of the day (e.g. 1096)
+def hhmm_to_minutes(t):
+    t = np.asarray(t, dtype=np.int64)
+    return (t // 100) * 60 + (t % 100)
+
+#converts minutes of the day back into times of the form hhmm
+def minutes_to_hhmm(m):
+    m = np.asarray(m, dtype=np.int64)
+    return (m // 60) * 100 + (m % 60)
+
+#builds the dwell interval table (see dwell_table) from the parts collected for each person
+#by graph_per_person.
+def build_dwell_table(parts):
+    counts = np.array([len(part['lat']) for part in parts], dtype=np.int64)
+    table = {}
+    table['offsets'] = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+    table['pidof'] = dict((str(parts[p]['name']), p) for p in range(0, len(parts)))
+    table['pid'] = np.repeat(np.arange(len(parts)), counts)
+    table['node'] = np.arange(counts.sum()) - np.repeat(table['offsets'][:-1], counts)
+    for col in ['lat', 'lon']:
+        table[col] = np.array([v for part in parts for v in part[col]], dtype=np.float64)
+    for col in ['entry', 'exit']:
+        table[col] = np.array([v for part in parts for v in part[col]], dtype=np.int64)
+    table['entmin'] = hhmm_to_minutes(table['entry'])
+    table['extmin'] = hhmm_to_minutes(table['exit'])
+    table['sick'] = np.repeat(np.array([part['con'] == 'sick' for part in parts], dtype=bool), counts)
+    table['name'] = [str(part['name']) for part in parts]
+    table['con'] = [str(part['con']) for part in parts]
+    printcov("Dwell interval table built for: " + str(len(parts)) + " people and: "
+        + str(counts.sum()) + " locations.")
+    return table
+
+#time overlap test for pairs of locations u & v (index arrays into the dwell table). Two
+#people overlap at a location if max(entry times) <= min(exit times).
+def dwell_overlap(u, v):
+    entmin = dwell_table['entmin']
+    extmin = dwell_table['extmin']
+    return np.maximum(entmin[u], entmin[v]) <= np.minimum(extmin[u], extmin[v])
+
+#validates the dwell interval table against the entry & exit times found by walking the
+#person graphs with find_startime_gx & find_endtime_gx.
+def test_dwell_table(gxall):
+    printcov("=========> Testing dwell interval table: ")
+    for p in range(0, len(gxall)):
+        name = str(gxall[p].graph['name'])
+        o = dwell_table['offsets'][p]
+        for n in range(0, len(gxall[p])):
+            assert dwell_table['entry'][o+n] == find_startime_gx(n, gxall[p], name), name + str(n)
+            assert dwell_table['exit'][o+n] == find_endtime_gx(n, gxall[p], name), name + str(n)
+    printcov("=========> Testing complete.")
+    return
+
+#expands ranges [lo[k], hi[k]) into flat arrays. Returns the owning k and the position
+#for every element of every range.
+def expand_ranges(lo, hi):
+    cnt = hi - lo
+    owner = np.repeat(np.arange(len(lo)), cnt)
+    pos = np.arange(cnt.sum()) - np.repeat(np.cumsum(cnt) - cnt, cnt) + np.repeat(lo, cnt)
+    return owner, pos
+
+#size (degrees of lat & lon) of spatial grid cells that are at least radius (km) wide for
+#locations up to latitude maxabslat (north or south)
+def grid_cell_size(radius, maxabslat):
+    cell_lat = np.degrees(radius / earth_min_radius) * grid_cell_margin
+    return cell_lat, cell_lat / max(np.cos(np.radians(maxabslat)), 1e-6)
+
+#finds all pairs of locations, belonging to different people, that may lie within radius
+#(km) of each other. Locations are bucketed into a uniform lat/lon grid whose cells are at
+#least radius wide, so only the 3x3 block of cells around a location needs to be searched.
+#Returns index pairs (u,v) into the location arrays where the person of u comes before the
+#person of v. Candidates still need an exact distance check.
+def grid_candidate_pairs(pids, lats, lons, radius):
+    if(len(lats) == 0):
+        return np.array([], dtype=np.int64), np.array([], dtype=np.int64)
+
+    cell_lat, cell_lon = grid_cell_size(radius, np.abs(lats).max())
+    cx = np.floor((lats - lats.min()) / cell_lat).astype(np.int64)
+    cy = np.floor((lons - lons.min()) / cell_lon).astype(np.int64)
+
+    #one flat key per cell. The +1/+3 leave room for the neighbouring cells at the edges.
+    ny = cy.max() + 3
+    keys = (cx + 1) * ny + (cy + 1)
+    order = np.argsort(keys, kind='mergesort')
+    sortedkeys = keys[order]
+
+    us = []
+    vs = []
+    for dx in (-1, 0, 1):
+        for dy in (-1, 0, 1):
+            nkeys = (cx + 1 + dx) * ny + (cy + 1 + dy)
+            lo = np.searchsorted(sortedkeys, nkeys, 'left')
+            hi = np.searchsorted(sortedkeys, nkeys, 'right')
+            u, pos = expand_ranges(lo, hi)
+            v = order[pos]
+            keep = pids[u] < pids[v]
+            us.append(u[keep])
+            vs.append(v[keep])
+
+    return np.concatenate(us), np.concatenate(vs)
+
+#finds all pairs of locations, belonging to different people, where both people were
+#present at the same time. Locations are sorted by entry time and swept in that order: the
+#locations overlapping a location are the ones entered after it but before it was exited.
+#Locations whose exit time is before the entry time (last node of a person) never overlap
+#and are skipped. Returns index pairs (u,v) into the dwell table where the person of u comes
+#before the person of v. Runs in O(V log V + K) for V locations and K overlapping pairs.
+def sweep_candidate_pairs(pids, entmin, extmin):
+    live = np.nonzero(entmin <= extmin)[0]
+    order = live[np.argsort(entmin[live], kind='mergesort')]
+    starts = entmin[order]
+    lo = np.arange(1, len(order) + 1)
+    hi = np.maximum(np.searchsorted(starts, extmin[order], 'right'), lo)
+    owner, pos = expand_ranges(lo, hi)
+    u = order[owner]
+    v = order[pos]
+    keep = pids[u] != pids[v]
+    u = u[keep]
+    v = v[keep]
+    swap = pids[u] > pids[v]
+    return np.where(swap, v, u), np.where(swap, u, v)
+
+#same as overlaps_for_pop but only compares locations that the spatial grid reports as
+#being close enough. Only breached location pairs are returned as travel history.
+def overlaps_for_pop_grid(gxall):
+    printcov("Finding overlaps within population's location history using a spatial grid")
+    printcov("Peak memory before overlap pass: " + str(peak_memory_mb()) + " MB")
+    u, v = grid_candidate_pairs(dwell_table['pid'], dwell_table['lat'], dwell_table['lon'],
+        microcell_radius)
+    printcov("Spatial grid found: " + str(len(u)) + " candidate location pairs out of: "
+        + str(len(dwell_table['pid'])) + " locations.")
+    return overlaps_for_candidates(gxall, u, v)
+
+#same as overlaps_for_pop but only compares locations where both people were present at
+#the same time, as found by a sweep over entry times. Only breached location pairs are
+#returned as travel history.
+def overlaps_for_pop_sweep(gxall):
+    printcov("Finding overlaps within population's location history using a time sweep")
+    printcov("Peak memory before overlap pass: " + str(peak_memory_mb()) + " MB")
+    u, v = sweep_candidate_pairs(dwell_table['pid'], dwell_table['entmin'], dwell_table['extmin'])
+    printcov("Time sweep found: " + str(len(u)) + " time overlapping location pairs out of: "
+        + str(len(dwell_table['pid'])) + " locations.")
+    return overlaps_for_candidates(gxall, u, v)
+
+#checks candidate location pairs (u,v) (index arrays into the dwell table, person of u before
+#person of v) for microcell breaches. Breaches are applied to biggx in the same order as the
+#brute force pass (anchor person, comparison person, anchor node, comparison node) so that
+#biggx ends up identical for the pairs checked. Returns the breached pairs as travel history.
+def overlaps_for_candidates(gxall, u, v):
+    #distance is calculated in both directions just like the brute force pass does. The
+    #numpy kernel is symmetric so one calculation serves both directions, as it does in
+    #symmetric mode.
+    if(overlap_pool is not None):
+        fwd, bwd = pool_candidate_distances(overlap_pool, u, v)
+    else:
+        fwd, bwd = candidate_distances(u, v, graph_locs(gxall))
+    count_metric('pairs_examined', 2 * len(u))
+    return overlaps_for_distances(gxall, u, v, fwd, bwd)
+
+#same as overlaps_for_candidates with the distances of the candidate pairs already known,
+#fwd from u to v and bwd from v to u.
+def overlaps_for_distances(gxall, u, v, fwd, bwd):
+    pids = dwell_table['pid']
+    nodeids = dwell_table['node']
+    names = [str(g.graph['name']) for g in gxall]
+    latlons = [nx.get_node_attributes(g,'latlon') for g in gxall]
+
+    breaches = []
+    for k in np.nonzero((fwd <= microcell_radius) | (bwd <= microcell_radius))[0]:
+        a = pids[u[k]]
+        b = pids[v[k]]
+        i = nodeids[u[k]]
+        j = nodeids[v[k]]
+        if(fwd[k] <= microcell_radius):
+            breaches.append((a, b, i, j, fwd[k], u[k], v[k]))
+        if(bwd[k] <= microcell_radius):
+            breaches.append((b, a, j, i, bwd[k], v[k], u[k]))
+    breaches.sort()
+
+    #time overlap of all breached location pairs in one go
+    lu = np.array([br[5] for br in breaches], dtype=np.int64)
+    lv = np.array([br[6] for br in breaches], dtype=np.int64)
+    timeoverlap = dwell_overlap(lu, lv)
+    entries = dwell_table['entry']
+    exits = dwell_table['exit']
+
+    #all breaches are marked in biggx in one go
+    cons = [str(g.graph['con']) for g in gxall]
+    risks = add_breaches([(names[x] + str(i), cons[x], names[y] + str(j), cons[y], timeoverlap[k],
+        distance) for k, (x, y, i, j, distance) in enumerate([br[:5] for br in breaches])])
+
+    rows = []
+    for k in range(0, len(breaches)):
+        x, y, i, j, distance = breaches[k][:5]
+        if(symmetric_pairs == 1 and expand_symmetric_rows == 0 and x > y):
+            continue
+        rows.append([names[x], cons[x], latlons[x][names[x] + str(i)],
+            entries[lu[k]], exits[lu[k]], names[y], cons[y],
+            latlons[y][names[y] + str(j)], entries[lv[k]], exits[lv[k]], distance, 'yes', risks[k]])
+
+    printcov("Peak memory after overlap pass: " + str(peak_memory_mb()) + " MB")
+    printcov("Completed overlap extractions. Found: " + str(len(rows)) + " breaches.")
+    b_all = pd.DataFrame(rows, columns = col_breach)
+
+    #every location of a person against every location of all other people
+    counts = np.diff(dwell_table['offsets'])
+    pairs = counts.sum() ** 2 - (counts ** 2).sum()
+    if(symmetric_pairs == 1 and expand_symmetric_rows == 0):
+        pairs = pairs // 2
+    summarize_travel_hist(b_all, pairs)
+    return b_all
+
+#same as overlaps_for_pop_grid but the grid is run by one shard per tile (see run_shard)
+#and their breaches are merged. A breach is found by the shard whose tile holds the location
+#of the person that comes first, so halo locations are never paired twice. Pairs found twice
+#anyway (e.g. shard folders from overlapping runs) are dropped.
+def overlaps_for_pop_sharded(gxall):
+    ntiles = shard_tiles[0] * shard_tiles[1]
+    printcov("Finding overlaps within population's location history using: " + str(ntiles)
+        + " shards of: " + str(shard_tiles[0]) + "x" + str(shard_tiles[1]) + " tiles")
+    printcov("Peak memory before overlap pass: " + str(peak_memory_mb()) + " MB")
+    if(shard_launch == 1):
+        launch_shards(ntiles)
+
+    offsets = dwell_table['offsets']
+    pidof = dwell_table['pidof']
+    us = []
+    vs = []
+    fwds = []
+    bwds = []
+    for k in range(0, ntiles):
+        cols, cats = load_columns(shard_path(k))
+        for n, pos in [('1', us), ('2', vs)]:
+            pids = np.array([pidof[name] for name in cats.get('name' + n, [])], dtype=np.int64)
+            pos.append(offsets[pids[np.asarray(cols['name' + n], dtype=np.int64)]]
+                + np.asarray(cols['node' + n], dtype=np.int64))
+        fwds.append(np.asarray(cols['fwd']))
+        bwds.append(np.asarray(cols['bwd']))
+    u = np.concatenate(us)
+    v = np.concatenate(vs)
+    keys, first = np.unique(u * len(dwell_table['pid']) + v, return_index=True)
+    printcov("Shards found: " + str(len(u)) + " breached location pairs, of which: "
+        + str(len(u) - len(first)) + " were duplicates.")
+    #the pairs the shards examined but did not breach are not sent back
+    count_metric('pairs_examined', 2 * len(first))
+    return overlaps_for_distances(gxall, u[first], v[first],
+        np.concatenate(fwds)[first], np.concatenate(bwds)[first])
+
+#starts one local process per shard, running this program with --shard K (and the same
+#command line options as this run), and waits for all of them. Each shard's output goes to
+#shard_K.log.
+def launch_shards(ntiles):
+    procs = []
+    for k in range(0, ntiles):
+        log = open("shard_" + str(k) + ".log", 'w')
+        procs.append((k, log, subprocess.Popen([sys.executable] + sys.argv + ['--shard', str(k)],
+            stdout=log, stderr=subprocess.STDOUT)))
+    for k, log, proc in procs:
+        proc.wait()
+        log.close()
+        if(proc.returncode != 0):
+            raise RuntimeError("Shard: " + str(k) + " failed. See shard_" + str(k) + ".log")
+    printcov("All: " + str(ntiles) + " shards completed.")
+    return
+
+#output folder of shard k
+def shard_path(k):
+    return "shard_" + str(k)
+
+#path of the prepp'd data written by dataprep
+def prepped_path():
+    if(is_prepped_columns(datapath)):
+        return datapath
+    if(storage_format == 'npy'):
+        return "preppd_df"
+    return "preppd_df.csv"
+
+#reads the person codes, lat, lon & time columns of the prepp'd data. Returns person codes
+#(in order of first appearance), names, lats, lons & times. Columns saved by the 'npy'
+#storage format are memory mapped.
+def load_prepped_columns(path):
+    if(os.path.isdir(path)):
+        cols, cats = load_columns(path)
+        return (np.asarray(cols['name'], dtype=np.int64), cats['name'], cols['lat'],
+            cols['lon'], cols['time'])
+    df = pd.read_csv(path, sep=',', header=0, usecols=['name','lat','lon','time'],
+        float_precision='round_trip')
+    codes, names = pd.factorize(df['name'].values)
+    return (codes.astype(np.int64), list(names), df['lat'].values, df['lon'].values,
+        df['time'].values)
+
+#tile of each location. Tiles are numbered row by row, rows along latitude.
+def shard_tile_of(lats, lons):
+    r = np.floor((lats - shard_box[0]) / (shard_box[1] - shard_box[0]) * shard_tiles[0])
+    c = np.floor((lons - shard_box[2]) / (shard_box[3] - shard_box[2]) * shard_tiles[1])
+    r = np.clip(r, 0, shard_tiles[0] - 1).astype(np.int64)
+    c = np.clip(c, 0, shard_tiles[1] - 1).astype(np.int64)
+    return r * shard_tiles[1] + c
+
+#locations that shard k needs: the ones in its tile and the ones in a halo of
+#microcell_radius around it. Edge tiles reach out to infinity on their outer sides.
+def shard_halo_of(lats, lons, k):
+    r = k // shard_tiles[1]
+    c = k % shard_tiles[1]
+    hlat = np.degrees(microcell_radius / earth_min_radius) * grid_cell_margin
+    hlon = hlat / max(np.cos(np.radians(np.abs(lats).max())), 1e-6)
+    dlat = (shard_box[1] - shard_box[0]) / float(shard_tiles[0])
+    dlon = (shard_box[3] - shard_box[2]) / float(shard_tiles[1])
+    inside = np.ones(len(lats), dtype=bool)
+    if(r > 0):
+        inside &= lats >= shard_box[0] + r * dlat - hlat
+    if(r < shard_tiles[0] - 1):
+        inside &= lats <= shard_box[0] + (r + 1) * dlat + hlat
+    if(c > 0):
+        inside &= lons >= shard_box[2] + c * dlon - hlon
+    if(c < shard_tiles[1] - 1):
+        inside &= lons <= shard_box[2] + (c + 1) * dlon + hlon
+    return inside
+
+#runs shard k: builds the dwell table of the locations in tile k and its halo from the
+#prepp'd data, runs the spatial grid over them and saves the breached pairs where the
+#location of the person that comes first is in the tile. Entry & exit times are worked out
+#the same way as in graph_per_person, from a person's neighbouring rows.
+def run_shard(k):
+    printcov("Running shard: " + str(k) + " of: " + str(shard_tiles[0]) + "x"
+        + str(shard_tiles[1]) + " tiles on: " + prepped_path())
+    codes, names, lats, lons, times = load_prepped_columns(prepped_path())
+    n = len(codes)
+    first = np.ones(n, dtype=bool)
+    first[1:] = codes[1:] != codes[:-1]
+    last = np.ones(n, dtype=bool)
+    last[:-1] = first[1:]
+    starts = np.maximum.accumulate(np.where(first, np.arange(n), 0))
+
+    idx = np.nonzero(shard_halo_of(lats, lons, k))[0]
+    owned = shard_tile_of(lats[idx], lons[idx]) == k
+    nxt = np.minimum(idx + 1, n - 1)
+    dwell_table['pid'] = codes[idx]
+    dwell_table['node'] = idx - starts[idx]
+    #lat & lon go through LatLon, like the graph nodes the dwell table is built from
+    dwell_table['lat'] = np.array([Latitude(x).decimal_degree for x in lats[idx]], dtype=np.float64)
+    dwell_table['lon'] = np.array([Longitude(x).decimal_degree for x in lons[idx]], dtype=np.float64)
+    dwell_table['entry'] = np.where(first[idx], 0, times[idx]).astype(np.int64)
+    dwell_table['exit'] = np.where(last[idx], 0, times[nxt]).astype(np.int64)
+    dwell_table['entmin'] = hhmm_to_minutes(dwell_table['entry'])
+    dwell_table['extmin'] = hhmm_to_minutes(dwell_table['exit'])
+    printcov("Shard holds: " + str(owned.sum()) + " locations and: "
+        + str(len(idx) - owned.sum()) + " halo locations out of: " + str(n))
+
+    u, v = grid_candidate_pairs(dwell_table['pid'], dwell_table['lat'], dwell_table['lon'],
+        microcell_radius)
+    keep = owned[u]
+    u = u[keep]
+    v = v[keep]
+    init_overlap_worker()
+    fwd, bwd = candidate_distances(u, v, dwell_locs)
+    hit = (fwd <= microcell_radius) | (bwd <= microcell_radius)
+    u = u[hit]
+    v = v[hit]
+    names = np.array(names, dtype=object)
+    out = pd.DataFrame(OrderedDict([('name1', names[dwell_table['pid'][u]]),
+        ('node1', dwell_table['node'][u]), ('name2', names[dwell_table['pid'][v]]),
+        ('node2', dwell_table['node'][v]), ('fwd', fwd[hit]), ('bwd', bwd[hit])]))
+    save_columns(out, shard_path(k), {'name1': names, 'name2': names})
+    printcov("Shard: " + str(k) + " found: " + str(len(out)) + " breached location pairs out of: "
+        + str(keep.sum()) + " candidates.")
+    return
+
+#flat key of the dwell index grid cell of each location. grid holds the cell size & origin
+#(see save_dwell_index). Cells are counted from the origin & may be negative, so the key of
+#the cell dx rows & dy columns away is key + dx * index_key_span + dy.
+def index_cell_keys(lats, lons, grid):
+    cx = np.floor((lats - grid[2]) / grid[0]).astype(np.int64)
+    cy = np.floor((lons - grid[3]) / grid[1]).astype(np.int64)
+    return cx * index_key_span + cy
+
+#folder of segment k of the dwell index
+def index_segment_path(k):
+    return os.path.join(dwell_index_path, "seg_" + str(k))
+
+#saves locations as segment k of the dwell index, sorted by grid cell. Returns the row of
+#each location within the segment.
+def save_index_segment(k, seg, grid):
+    keys = index_cell_keys(seg['lat'], seg['lon'], grid)
+    order = np.argsort(keys, kind='mergesort')
+    save_columns(pd.DataFrame(OrderedDict((c, np.asarray(seg[c])[order]) for c in
+        ['pid', 'node', 'lat', 'lon', 'entry', 'exit'])), index_segment_path(k), {},
+        {'cell': keys[order]})
+    rows = np.empty(len(order), dtype=np.int64)
+    rows[order] = np.arange(len(order))
+    return rows
+
+#saves the dwell index of a full run, replacing any earlier one. The people table holds for
+#each person (in person id order): name, condition (as in the dwell table), whether any of their
+#readings is sick, no of locations, time of the first & last reading and where the last
+#location is (segment & row) so that its exit time can be updated when new readings arrive.
+def save_dwell_index(table, df):
+    if(os.path.isdir(dwell_index_path)):
+        shutil.rmtree(dwell_index_path)
+    os.makedirs(dwell_index_path)
+    if(len(table['lat']) == 0):
+        return
+    grid = np.array(grid_cell_size(microcell_radius, np.abs(table['lat']).max())
+        + (table['lat'].min(), table['lon'].min()))
+    np.save(os.path.join(dwell_index_path, 'grid.npy'), grid)
+    rows = save_index_segment(0, table, grid)
+
+    names = table['name']
+    sick = set(df.loc[df['condition'] == 'sick', 'name'])
+    firsttime = df.groupby('name', sort=False)['time'].first()
+    lasttime = df.groupby('name', sort=False)['time'].last()
+    people = pd.DataFrame(OrderedDict([('name', names),
+        ('con', table['con']),
+        ('sick', [int(n in sick) for n in names]),
+        ('count', np.diff(table['offsets'])),
+        ('firsttime', [firsttime[n] for n in names]),
+        ('lasttime', [lasttime[n] for n in names]),
+        ('lastseg', np.zeros(len(names), dtype=np.int64)),
+        ('lastrow', rows[table['offsets'][1:] - 1])]))
+    save_columns(people, os.path.join(dwell_index_path, 'people'))
+    printcov("Saved dwell index of: " + str(len(rows)) + " locations to: " + dwell_index_path)
+    return
+
+#adds the readings in the file at path to biggx (loaded from an earlier run) and to the dwell
+#index. The new locations are compared with all locations within the microcell radius of
+#them, found through the dwell index, and breaches are marked exactly as the 'grid' engine
+#does. A person's last location so far gets an exit time now, so its time overlaps with the
+#locations around it are checked again. Returns the travel history of the new readings and
+#the list of known infected people.
+def trace_delta(path):
+    printcov("Tracing new readings in: " + path + " against: " + dwell_index_path)
+    grid = np.load(os.path.join(dwell_index_path, 'grid.npy'))
+    if(grid_cell_size(microcell_radius, 0)[0] > grid[0]):
+        raise ValueError("Dwell index was built for a smaller microcell radius. Do a full run.")
+    people = columns_to_frame(*load_columns(os.path.join(dwell_index_path, 'people')))
+    people = dict((c, list(people[c])) for c in people.columns)
+    if('firsttime' not in people):
+        raise ValueError("Dwell index was saved without the first reading times. Do a full run.")
+    pidof = dict((people['name'][p], p) for p in range(0, len(people['name'])))
+    nseg = len([f for f in os.listdir(dwell_index_path) if f.startswith('seg_')])
+
+    #new locations, node labels & edges, in the same way as dataprep & graph_per_person
+    raw = pd.read_csv(path, sep=',', header=0)
+    new = dict((c, []) for c in ['pid', 'node', 'lat', 'lon', 'entry', 'exit'])
+    retimed = [] #(pid, segment, row, new exit time) of last locations so far
+    #the sort is always stable here, see stable_time_sort
+    for currname, df in raw.groupby('name', sort=False):
+        df = df.sort_values(by=['time'], kind='mergesort').reset_index(drop=True)
+        times = list(df['time'])
+        if(currname not in pidof):
+            pidof[currname] = len(people['name'])
+            for c, val in [('name', currname), ('con', df['condition'][0]), ('sick', 0),
+                ('count', 0), ('firsttime', times[0]), ('lasttime', 0), ('lastseg', -1),
+                ('lastrow', -1)]:
+                people[c].append(val)
+        p = pidof[currname]
+        count = people['count'][p]
+        if(count > 0 and times[0] < people['lasttime'][p]):
+            raise ValueError("New readings of: " + str(currname) + " are earlier than their "
+                "readings so far. Do a full run.")
+        if(count > 0):
+            retimed.append((p, people['lastseg'][p], people['lastrow'][p], times[0]))
+        if(debug_output):
+            printcov("Adding: " + str(len(df)) + " readings for: " + str(currname))
+        for n in range(0, len(df)):
+            nodelabel = str(currname) + str(count + n)
+            loc = LatLon(Latitude(df['lat'][n]), Longitude(df['lon'][n]))
+            biggx.add_node(nodelabel, latlon=loc)
+            if(count + n > 0):
+                biggx.add_edge(str(currname) + str(count + n - 1), nodelabel, time=times[n])
+            new['pid'].append(p)
+            new['node'].append(count + n)
+            new['lat'].append(loc.lat.decimal_degree)
+            new['lon'].append(loc.lon.decimal_degree)
+            new['entry'].append(0 if count + n == 0 else times[n])
+            new['exit'].append(times[n+1] if n + 1 < len(df) else 0)
+        people['count'][p] = count + len(df)
+        people['lasttime'][p] = times[-1]
+        people['sick'][p] = max(people['sick'][p], int((df['condition'] == 'sick').any()))
+    for c in new:
+        new[c] = np.array(new[c], dtype=(np.float64 if c in ['lat', 'lon'] else np.int64))
+    if(len(people['name']) > 0):
+        biggx.graph.update(name=people['name'][-1], con=people['con'][-1])
+
+    #last locations so far get their exit time, in place in their segment
+    oldexit = {}
+    for p, seg, row, t in retimed:
+        exits = np.load(column_file(index_segment_path(seg), 'exit'), mmap_mode='r+')
+        oldexit[(seg, row)] = int(exits[row])
+        exits[row] = t
+        exits.flush()
+        del exits
+
+    #locations in the index around the new & retimed locations
+    dlats = np.concatenate([new['lat'], [load_column(index_segment_path(seg), 'lat')[row]
+        for p, seg, row, t in retimed]]).astype(np.float64)
+    dlons = np.concatenate([new['lon'], [load_column(index_segment_path(seg), 'lon')[row]
+        for p, seg, row, t in retimed]]).astype(np.float64)
+    found = []
+    if(len(dlats) > 0):
+        dkeys = index_cell_keys(dlats, dlons, grid)
+        span = int(np.ceil(grid_cell_size(microcell_radius, np.abs(dlats).max())[1] / grid[1]))
+        for seg in range(0, nseg):
+            cells = load_column(index_segment_path(seg), 'cell')
+            for dx in (-1, 0, 1):
+                for dy in range(-span, span + 1):
+                    nkeys = dkeys + dx * index_key_span + dy
+                    lo = np.searchsorted(cells, nkeys, 'left')
+                    hi = np.searchsorted(cells, nkeys, 'right')
+                    found.append((seg, expand_ranges(lo, hi)[1]))
+
+    #working dwell table: new locations first, then the ones found in the index
+    parts = dict((c, [new[c]]) for c in new)
+    wasexit = [new['exit']]
+    nfound = 0
+    for seg in range(0, nseg):
+        rows = np.unique(np.concatenate([[]] + [r for sg, r in found if sg == seg])).astype(np.int64)
+        for c in parts:
+            parts[c].append(load_column(index_segment_path(seg), c)[rows])
+        wasexit.append(np.array([oldexit.get((seg, row), parts['exit'][-1][k])
+            for k, row in enumerate(rows)], dtype=np.int64))
+        nfound = nfound + len(rows)
+    table = dict((c, np.concatenate(parts[c]).astype(np.float64 if c in ['lat', 'lon'] else np.int64))
+        for c in parts)
+    wasexit = np.concatenate(wasexit)
+    table['entmin'] = hhmm_to_minutes(table['entry'])
+    table['extmin'] = hhmm_to_minutes(table['exit'])
+    dwell_table.clear()
+    dwell_table.update(table)
+    isnew = np.arange(len(table['pid'])) < len(new['pid'])
+    retimedloc = wasexit != table['exit']
+    printcov("Comparing: " + str(len(new['pid'])) + " new & " + str(retimedloc.sum())
+        + " retimed locations with: " + str(nfound) + " locations from the dwell index.")
+
+    u, v = grid_candidate_pairs(table['pid'], table['lat'], table['lon'], microcell_radius)
+    keep = isnew[u] | isnew[v] | retimedloc[u] | retimedloc[v]
+    u = u[keep]
+    v = v[keep]
+    labels = [people['name'][table['pid'][k]] + str(table['node'][k]) for k in range(0, len(table['pid']))]
+    locs = [biggx.nodes[lbl]['latlon'] for lbl in labels]
+    fwd, bwd = candidate_distances(u, v, locs)
+    count_metric('pairs_examined', 2 * len(u))
+
+    #breaches in the same order as overlaps_for_distances. Pairs of old locations already
+    #have their breach edges, only their time overlap is new.
+    breaches = []
+    for k in np.nonzero((fwd <= microcell_radius) | (bwd <= microcell_radius))[0]:
+        a = table['pid'][u[k]]
+        b = table['pid'][v[k]]
+        i = table['node'][u[k]]
+        j = table['node'][v[k]]
+        if(fwd[k] <= microcell_radius):
+            breaches.append((a, b, i, j, fwd[k], u[k], v[k]))
+        if(bwd[k] <= microcell_radius):
+            breaches.append((b, a, j, i, bwd[k], v[k], u[k]))
+    breaches.sort()
+    lu = np.array([br[5] for br in breaches], dtype=np.int64)
+    lv = np.array([br[6] for br in breaches], dtype=np.int64)
+    timeoverlap = dwell_overlap(lu, lv)
+    oldentmin = table['entmin']
+    oldextmin = hhmm_to_minutes(wasexit)
+    wasoverlap = (np.maximum(oldentmin[lu], oldentmin[lv]) <= np.minimum(oldextmin[lu], oldextmin[lv]))
+
+    rows = []
+    for k in range(0, len(breaches)):
+        x, y, i, j, distance = breaches[k][:5]
+        anchor = labels[lu[k]]
+        compar = labels[lv[k]]
+        if(isnew[lu[k]] or isnew[lv[k]]):
+            risk = mark_breach(anchor, people['con'][x], compar, people['con'][y], timeoverlap[k],
+                distance)
+        elif(timeoverlap[k] and not wasoverlap[k]):
+            risk = mark_time_overlap(anchor, people['con'][x], compar, people['con'][y], True)
+            if(risk != 'high'):
+                continue
+        else:
+            continue
+        rows.append([people['name'][x], people['con'][x], locs[lu[k]], table['entry'][lu[k]],
+            table['exit'][lu[k]], people['name'][y], people['con'][y], locs[lv[k]],
+            table['entry'][lv[k]], table['exit'][lv[k]], distance, 'yes', risk])
+    th = pd.DataFrame(rows, columns = col_breach)
+    printcov("Found: " + str(len(rows)) + " new breaches (high risk: "
+        + str((th['risk'] == 'high').sum()) + ").")
+    metrics['breaches'] = len(rows)
+    metrics['high_risk'] = int((th['risk'] == 'high').sum())
+
+    #new locations go to a new segment of the index
+    if(len(new['pid']) > 0):
+        segrows = save_index_segment(nseg, new, grid)
+        for k in range(0, len(new['pid'])):
+            p = new['pid'][k]
+            if(new['node'][k] == people['count'][p] - 1):
+                people['lastseg'][p] = nseg
+                people['lastrow'][p] = segrows[k]
+    save_columns(pd.DataFrame(OrderedDict((c, people[c]) for c in ['name', 'con', 'sick',
+        'count', 'firsttime', 'lasttime', 'lastseg', 'lastrow'])), os.path.join(dwell_index_path, 'people'))
+    persons[:] = people['name']
+    first_readings.clear()
+    first_readings.update(zip(people['name'], people['firsttime']))
+    infected = [people['name'][p] for p in range(0, len(people['name'])) if people['sick'][p] == 1]
+    return th, infected
+
+#vectorized inverse Vincenty formula on the WGS84 ellipsoid. Takes lat/lon in degrees as
+#numpy arrays (anything that broadcasts, e.g. a column of one person's locations against a
+#row of a block of people's locations) and returns the distances in km in the same shape.
+def vincenty_distance(lat1, lon1, lat2, lon2):
+    lat1, lon1, lat2, lon2 = np.broadcast_arrays(np.radians(lat1), np.radians(lon1),
+        np.radians(lat2), np.radians(lon2))
+    f = wgs84_f
+    U1 = np.arctan((1 - f) * np.tan(lat1))
+    U2 = np.arctan((1 - f) * np.tan(lat2))
+    sinU1 = np.sin(U1)
+    cosU1 = np.cos(U1)
+    sinU2 = np.sin(U2)
+    cosU2 = np.cos(U2)
+    L = lon2 - lon1
+    lam = L
+
+    #iterate till lambda converges for every pair. Small distances converge in 2-3 rounds.
+    #Pairs that have converged are frozen so that each distance only depends on its own pair
+    #and not on which other pairs are calculated along with it.
+    done = np.zeros(L.shape, dtype=bool)
+    for it in range(0, 100):
+        sinlam = np.sin(lam)
+        coslam = np.cos(lam)
+        sinsig = np.sqrt((cosU2 * sinlam) ** 2 + (cosU1 * sinU2 - sinU1 * cosU2 * coslam) ** 2)
+        cossig = sinU1 * sinU2 + cosU1 * cosU2 * coslam
+        sig = np.arctan2(sinsig, cossig)
+        #coincident points have sinsig == 0 and equatorial lines have cos2alpha == 0
+        sinalpha = cosU1 * cosU2 * sinlam / np.where(sinsig == 0, 1.0, sinsig)
+        cos2alpha = 1 - sinalpha ** 2
+        cos2sigm = np.where(cos2alpha == 0, 0.0,
+            cossig - 2 * sinU1 * sinU2 / np.where(cos2alpha == 0, 1.0, cos2alpha))
+        C = f / 16 * cos2alpha * (4 + f * (4 - 3 * cos2alpha))
+        lamnext = L + (1 - C) * f * sinalpha * (sig + C * sinsig *
+            (cos2sigm + C * cossig * (-1 + 2 * cos2sigm ** 2)))
+        done = done | (np.abs(lamnext - lam) <= 1e-15)
+        lam = np.where(done, lam, lamnext)
+        if(np.all(done)):
+            break
+
+    u2 = cos2alpha * (wgs84_a ** 2 - wgs84_b ** 2) / wgs84_b ** 2
+    A = 1 + u2 / 16384 * (4096 + u2 * (-768 + u2 * (320 - 175 * u2)))
+    B = u2 / 1024 * (256 + u2 * (-128 + u2 * (74 - 47 * u2)))
+    dsig = B * sinsig * (cos2sigm + B / 4 * (cossig * (-1 + 2 * cos2sigm ** 2) -
+        B / 6 * cos2sigm * (-3 + 4 * sinsig ** 2) * (-3 + 4 * cos2sigm ** 2)))
+    return wgs84_b * A * (sig - dsig)
+
+#validates the 'numpy' distance kernel against LatLon.distance(). Compares the first
+#person's locations with everyone's locations and fails if the difference is more than
+#distance_kernel_tolerance.
+def test_distance_kernel(gxall):
+    printcov("=========> Testing numpy distance kernel against LatLon: ")
+    lats = dwell_table['lat']
+    lons = dwell_table['lon']
+    anchor = np.nonzero(dwell_table['pid'] == 0)[0]
+    kernel = vincenty_distance(lats[anchor][:, None], lons[anchor][:, None],
+        lats[None, :], lons[None, :])
+    maxdev = 0.0
+    for a in range(0, len(anchor)):
+        loca = LatLon(Latitude(lats[anchor[a]]), Longitude(lons[anchor[a]]))
+        for b in range(0, len(lats)):
+            locb = LatLon(Latitude(lats[b]), Longitude(lons[b]))
+            maxdev = max(maxdev, abs(kernel[a][b] - loca.distance(locb)))
+    printcov("Max difference from LatLon is: " + str(maxdev) + " km over: "
+        + str(kernel.size) + " location pairs.")
+    assert maxdev <= distance_kernel_tolerance, "numpy distance kernel is off by " + str(maxdev) + " km"
+    printcov("=========> Testing complete.")
+    return maxdev
+
+#allows to validate all graphs. For each graph, walks it, explodes nodes and edges. Only
+#prints, so it is only run when log_level is 'debug'.
 def test_all_graphs(g):
     printcov("=========> Testing all graphs: ")
     for i in range(0, len(g)):
@@ -346,12 +1872,17 @@ def test_all_graphs(g):
     return
 
 #builds a graph for all of the population. Is an undirected
-#graph and is used for running analysis algorithms.
+#graph and is used for running analysis algorithms. All nodes & edges of all people are added
+#in one pass, in the same order (and with the same keys & attributes) that composing the
+#undirected graphs of the people one by one gives, without copying the graph built so far.
 def build_bigdaddy(gxarray):
 
     gxdaddytemp = nx.MultiGraph()
     for i in range(0,len(gxarray)):
-        gxdaddytemp = nx.compose(gxdaddytemp,gxarray[i].to_undirected())
+        gxdaddytemp.graph.update(gxarray[i].graph)
+        gxdaddytemp.add_nodes_from(gxarray[i].nodes(data=True))
+    gxdaddytemp.add_edges_from((x, y, key, dict(attrs)) for i in range(0,len(gxarray))
+        for x, y, key, attrs in gxarray[i].edges(keys=True, data=True))
 
     return gxdaddytemp
 
@@ -370,42 +1901,320 @@ def read_graph_from_pickle(picklepath):
     g = nx.read_gpickle(picklepath)
     return g
 
-def find_infection_start_locs(g):
-    nattrib_infec_start_loc = nx.get_node_attributes(g,'infec_start_loc')
+#sha1 of the data at path, a data file or a folder of prepp'd data columns
+def data_hash(path):
+    h = hashlib.sha1()
+    files = [path]
+    if(os.path.isdir(path)):
+        files = [os.path.join(path, f) for f in sorted(os.listdir(path))]
+    for fname in files:
+        h.update(os.path.basename(fname).encode('utf-8'))
+        f = open(fname, 'rb')
+        for block in iter(lambda: f.read(1 << 20), b''):
+            h.update(block)
+        f.close()
+    return h.hexdigest()
+
+#what the artifacts of a run on datapath depend on: the hash of the data & the parameters
+#that change the prepp'd data or the results of the overlap pass. workers, ingest_chunksize &
+#the shard settings don't, by design.
+def artifact_params():
+    return OrderedDict([('format', cache_format), ('data', data_hash(datapath)),
+        ('microcell_radius', repr(microcell_radius)), ('overlap_engine', overlap_engine),
+        ('distance_kernel', distance_kernel), ('travel_hist_mode', travel_hist_mode),
+        ('symmetric_pairs', symmetric_pairs), ('expand_symmetric_rows', expand_symmetric_rows),
+        ('stable_time_sort', stable_time_sort)])
+
+#key of the artifacts of a run with the given artifact_params
+def artifact_key(params):
+    return hashlib.sha1(json.dumps(params).encode('utf-8')).hexdigest()
+
+#folder of the artifact cache entry of key
+def artifact_path(key):
+    return os.path.join(cache_path, key)
+
+#saves the dwell interval table as a folder of .npy files, one per array
+def save_dwell_table(table, path):
+    os.makedirs(path)
+    for col in table:
+        if(col in ['name', 'con']):
+            np.save(column_file(path, col), np.array(table[col], dtype=np.string_))
+        elif(col != 'pidof'):
+            np.save(column_file(path, col), table[col])
+    return
+
+#reads a dwell interval table saved by save_dwell_table
+def load_dwell_table(path):
+    table = {}
+    for f in os.listdir(path):
+        table[f[:-len('.npy')]] = np.load(os.path.join(path, f))
+    for col in ['name', 'con']:
+        table[col] = [as_str(c) for c in table[col]]
+    table['pidof'] = dict((table['name'][p], p) for p in range(0, len(table['name'])))
+    return table
+
+#saves biggx to path as lists of its nodes (with their attributes) & edges in the order they
+#were added: the nodes & trajectory edges of the person graphs gxall as build_bigdaddy adds
+#them, then the breach edges in the order of log (see breach_log). Pickled uncompressed with
+#the highest protocol, which loads several times faster than graph.gz. A pickled graph itself
+#loads with its nodes & neighbours in another order on python 2, and the communities depend
+#on that order.
+def save_artifact_graph(path, gxall, log):
+    nodes = [(n, biggx.nodes[n]) for gx in gxall for n in gx.nodes]
+    edges = [(x, y, key, attrs) for gx in gxall for x, y, key, attrs in gx.edges(keys=True, data=True)]
+    f = open(path, 'wb')
+    pickle.dump((dict(biggx.graph), nodes, edges, [(br[0], br[2]) for br in log]), f,
+        pickle.HIGHEST_PROTOCOL)
+    f.close()
+    return
+
+#saves the artifacts of a full run (the prepp'd data, dwell interval table, travel history,
+#biggx, see save_artifact_graph, & the counters of the run so far) as the artifact cache entry
+#of key, then evicts entries beyond cache_max_mb. The entry is written to a temporary folder
+#first so that a run that fails halfway leaves no entry behind.
+def save_artifacts(key, params, gxall, log):
+    path = artifact_path(key)
+    tmp = path + '.tmp' + str(os.getpid())
+    if(os.path.isdir(tmp)):
+        shutil.rmtree(tmp)
+    save_columns(sorteddf, os.path.join(tmp, 'preppd_df'), {'name': persons})
+    save_columns(travel_hist_columns(travel_hist), os.path.join(tmp, 'travelhist_df'),
+        {'name1': persons, 'name2': persons}, {'index': np.asarray(travel_hist.index, dtype=np.int64)})
+    save_dwell_table(dwell_table, os.path.join(tmp, 'dwell'))
+    save_artifact_graph(os.path.join(tmp, 'graph.pkl'), gxall, log)
+    f = open(os.path.join(tmp, 'metrics.json'), 'w')
+    json.dump(metrics, f)
+    f.close()
+    #written last, an entry is complete once it has key.json
+    f = open(os.path.join(tmp, 'key.json'), 'w')
+    json.dump(params, f, indent=1)
+    f.close()
+    if(os.path.isdir(path)):
+        shutil.rmtree(path)
+    os.rename(tmp, path)
+    printcov("Saved artifacts to: " + path)
+    evict_artifacts()
+    return
+
+#whether the artifact cache holds a complete entry for key
+def artifacts_cached(key):
+    return os.path.exists(os.path.join(artifact_path(key), 'key.json'))
+
+#loads the artifact cache entry of key. Returns the prepp'd data, dwell interval table & biggx.
+#The names of all people are added to persons & the counters of the run that saved the entry
+#to metrics. The travel history is only needed to save the outputs again, see
+#load_artifact_travel_hist.
+def load_artifacts(key):
+    path = artifact_path(key)
+    os.utime(os.path.join(path, 'key.json'), None) #last used, see evict_artifacts
+    cols, cats = load_columns(os.path.join(path, 'preppd_df'))
+    df = columns_to_frame(cols, cats)
+    persons.extend(cats['name'])
+    table = load_dwell_table(os.path.join(path, 'dwell'))
+    g = load_artifact_graph(os.path.join(path, 'graph.pkl'))
+    f = open(os.path.join(path, 'metrics.json'))
+    metrics.update(json.load(f, object_pairs_hook=OrderedDict))
+    f.close()
+    printcov("Loaded artifacts of: " + str(len(persons)) + " people from: " + path)
+    return df, table, g
+
+#loads biggx saved by save_artifact_graph, adding its nodes & edges in the order they were
+#saved in, so it iterates them in the same order as the graph that was saved
+def load_artifact_graph(path):
+    f = open(path, 'rb')
+    graph, nodes, edges, breaches = pickle.load(f)
+    f.close()
+    g = nx.MultiGraph()
+    g.graph.update(graph)
+    g.add_nodes_from(nodes)
+    g.add_edges_from(edges)
+    g.add_edges_from([(x, y, {'breachnodes': x + ':' + y}) for x, y in breaches])
+    return g
+
+#loads the travel history from the artifact cache entry of key, with the index it was saved with
+def load_artifact_travel_hist(key):
+    path = os.path.join(artifact_path(key), 'travelhist_df')
+    th = travel_hist_from_columns(columns_to_frame(*load_columns(path)))
+    th.index = np.asarray(load_column(path, 'index'))
+    return th
+
+#removes the entries of the artifact cache used least recently (by the time of their
+#key.json) till the cache holds no more than cache_max_mb. Entries still being written have
+#no key.json yet and are left alone.
+def evict_artifacts():
+    entries = []
+    for e in os.listdir(cache_path):
+        path = artifact_path(e)
+        if(not artifacts_cached(e)):
+            continue
+        size = sum(os.path.getsize(os.path.join(d, f)) for d, _, files in os.walk(path) for f in files)
+        entries.append((os.path.getmtime(os.path.join(path, 'key.json')), e, size))
+    entries.sort()
+    total = sum(size for used, e, size in entries)
+    while(len(entries) > 0 and total > cache_max_mb * 1024 * 1024):
+        used, e, size = entries.pop(0)
+        shutil.rmtree(artifact_path(e))
+        total = total - size
+        printcov("Evicted artifacts: " + artifact_path(e) + " (" + str(size // 1024) + " KB)")
+    return
+
+#the stamp of the outputs in the current folder (see output_stamp_path). '' = none.
+def read_output_stamp():
+    if(not os.path.exists(output_stamp_path)):
+        return ''
+    f = open(output_stamp_path)
+    stamp = f.read()
+    f.close()
+    return stamp
+
+#whether all the outputs a full run saves in the current folder are there (see
+#output_stamp_path). The prepp'd data is only saved when datapath isn't prepp'd already.
+def outputs_saved():
+    names = ['travelhist_df'] + ([] if is_prepped_columns(datapath) else ['preppd_df'])
+    files = [n + '.csv' for n in names if storage_format == 'csv' or export_csv == 1]
+    files = files + [n for n in names if storage_format == 'npy']
+    return all(os.path.exists(f) for f in files + [dwell_index_path, 'graph.gz'])
+
+#records stamp as that of the outputs in the current folder. '' removes it, for runs that
+#change the outputs without a key.
+def write_output_stamp(stamp):
+    if(os.path.exists(output_stamp_path)):
+        os.remove(output_stamp_path)
+    if(stamp != ''):
+        f = open(output_stamp_path, 'w')
+        f.write(stamp)
+        f.close()
+    return
+
+#builds the compact form of a graph like biggx, for the analysis. Nodes get integer ids in
+#the order networkx iterates them. The compact graph is a dict of:
+# - labels: node labels by id, idof: id of each label
+# - person: id of the person of each node, in names (the label without its digits)
+# - lat, lon: location of each node
+# - breached, infec_start_loc: node attributes as bool arrays
+# - indptr, indices, weight: adjacency in CSR form. The neighbours of node i are
+#   indices[indptr[i]:indptr[i+1]] in the order networkx iterates them, and weight holds the
+#   no of parallel edges to each.
+# - eu, ev, ekey, etime, ebreach: every edge with its key. etime is the 'time' attribute of
+#   trajectory edges (-1 = none) & ebreach marks breach edges, eu being the anchor node of
+#   the breach (as in breachnodes).
+# - graph: the graph attributes
+def compact_graph(g):
+    labels = list(g.nodes)
+    idof = dict((labels[i], i) for i in range(0, len(labels)))
+    onlynames = [''.join([c for c in lbl if not c.isdigit()]) for lbl in labels]
+    names, person = np.unique(np.array(onlynames, dtype=object), return_inverse=True)
+    lat = np.empty(len(labels), dtype=np.float64)
+    lon = np.empty(len(labels), dtype=np.float64)
+    breached = np.zeros(len(labels), dtype=bool)
+    infec = np.zeros(len(labels), dtype=bool)
+    for i, (lbl, attrs) in enumerate(g.nodes(data=True)):
+        if('latlon' in attrs):
+            lat[i] = float(attrs['latlon'].lat.decimal_degree)
+            lon[i] = float(attrs['latlon'].lon.decimal_degree)
+        breached[i] = attrs.get('breached') == 'yes'
+        infec[i] = attrs.get('infec_start_loc') == 'yes'
+
+    indptr = np.zeros(len(labels) + 1, dtype=np.int64)
+    indices = []
+    weight = []
+    for i, (lbl, nbrs) in enumerate(g.adj.items()):
+        indptr[i+1] = indptr[i] + len(nbrs)
+        for nbr, keys in nbrs.items():
+            indices.append(idof[nbr])
+            weight.append(len(keys))
+
+    edges = []
+    for x, y, key, attrs in g.edges(keys=True, data=True):
+        isbreach = 'breachnodes' in attrs
+        if(isbreach and attrs['breachnodes'] != x + ':' + y):
+            x, y = y, x
+        edges.append((idof[x], idof[y], key, attrs.get('time', -1), isbreach))
+    edges = np.array(edges, dtype=np.int64).reshape(-1, 5)
+
+    return {'labels': labels, 'idof': idof, 'person': person.astype(np.int64),
+        'names': list(names), 'lat': lat, 'lon': lon, 'breached': breached,
+        'infec_start_loc': infec, 'indptr': indptr, 'indices': np.array(indices, dtype=np.int64),
+        'weight': np.array(weight, dtype=np.int64), 'eu': edges[:, 0], 'ev': edges[:, 1],
+        'ekey': edges[:, 2], 'etime': edges[:, 3], 'ebreach': edges[:, 4] == 1,
+        'graph': dict(g.graph)}
+
+#turns a compact graph (see compact_graph) back into a networkx graph like biggx
+def compact_to_graph(cg):
+    g = nx.MultiGraph()
+    g.graph.update(cg['graph'])
+    labels = cg['labels']
+    for i in range(0, len(labels)):
+        g.add_node(labels[i], latlon=LatLon(Latitude(cg['lat'][i]), Longitude(cg['lon'][i])))
+        if(cg['breached'][i]):
+            g.nodes[labels[i]]['breached'] = 'yes'
+        if(cg['infec_start_loc'][i]):
+            g.nodes[labels[i]]['infec_start_loc'] = 'yes'
+    for k in range(0, len(cg['eu'])):
+        x = labels[cg['eu'][k]]
+        y = labels[cg['ev'][k]]
+        key = int(cg['ekey'][k])
+        if(cg['ebreach'][k]):
+            g.add_edge(x, y, key=key, breachnodes=(x + ':' + y))
+        elif(cg['etime'][k] >= 0):
+            g.add_edge(x, y, key=key, time=int(cg['etime'][k]))
+        else:
+            g.add_edge(x, y, key=key)
+    return g
+
+#degree of every node of a compact graph, counting parallel edges & self loops twice, as
+#networkx does.
+def compact_degree(cg):
+    rows = np.repeat(np.arange(len(cg['labels'])), np.diff(cg['indptr']))
+    selfloops = np.where(cg['indices'] == rows, cg['weight'], 0)
+    return np.bincount(rows, weights=cg['weight'] + selfloops,
+        minlength=len(cg['labels'])).astype(np.int64)
+
+#validates a compact graph against the graph it was built from. The round trip back to
+#networkx is only checked with log_level 'debug' as it needs another copy of the graph.
+def test_compact_graph(g, cg):
+    printcov("=========> Testing compact graph: ")
+    deg = compact_degree(cg)
+    labels = cg['labels']
+    for lbl, d in g.degree():
+        assert deg[cg['idof'][lbl]] == d, lbl
+    assert nx.get_node_attributes(g,'breached') == dict((labels[i], 'yes')
+        for i in np.nonzero(cg['breached'])[0]), "breached"
+    assert nx.get_node_attributes(g,'infec_start_loc') == dict((labels[i], 'yes')
+        for i in np.nonzero(cg['infec_start_loc'])[0]), "infec_start_loc"
+    assert len(cg['eu']) == g.number_of_edges(), "edges"
+    if(debug_output):
+        back = compact_to_graph(cg)
+        assert sorted(back.nodes(data=True)) == sorted(g.nodes(data=True)), "round trip nodes"
+        edges = lambda gx: sorted((tuple(sorted((x, y))), key, sorted(attrs.items()))
+            for x, y, key, attrs in gx.edges(keys=True, data=True))
+        assert edges(back) == edges(g), "round trip edges"
+    printcov("=========> Testing complete.")
+    return
+
+def find_infection_start_locs(cg):
+    nattrib_infec_start_loc = dict((cg['labels'][i], 'yes')
+        for i in np.nonzero(cg['infec_start_loc'])[0])
     printcov("Infection start locations for healthy people are: \n" + str(nattrib_infec_start_loc))
     return nattrib_infec_start_loc
 
-def find_high_traffic_locations(g):
-    node_deg = dict(nx.degree(g))
-    sorted_nodedeg = [(k, node_deg[k]) for k in sorted(node_deg, key=node_deg.get, reverse=True)]
-    top5nodes_by_deg = []
-    top5nodes_by_deg.append(sorted_nodedeg[0])
-    top5nodes_by_deg.append(sorted_nodedeg[1])
-    top5nodes_by_deg.append(sorted_nodedeg[2])
-    top5nodes_by_deg.append(sorted_nodedeg[3])
-    top5nodes_by_deg.append(sorted_nodedeg[4])
-
-    di = nx.get_node_attributes(g,'breached')
+#the (up to) 5 locations with the highest degree that were breached. Ties go to the node
+#networkx iterates first.
+def find_high_traffic_locations(cg):
+    top5nodes_by_deg = np.argsort(-compact_degree(cg), kind='mergesort')[:5]
+    top = np.zeros(len(cg['labels']), dtype=bool)
+    top[top5nodes_by_deg] = True
 
     printcov("These locations have witnessed high traffic: ")
-    htl = []
-    for n in g.nodes:
-        for n2 in top5nodes_by_deg:
-            if(n == n2[0]):
-                for n3 in di:
-                    if(n2[0] == n3):
-                        print(str(n3))
-                        htl.append(n3)
+    htl = [cg['labels'][i] for i in np.nonzero(top & cg['breached'])[0]]
+    for n3 in htl:
+        print(str(n3))
     return htl
 
-def predict_next_infec_locations(g):
-    neighb_nodes=[]
-
-    infec_start_locs = nx.get_node_attributes(g,'infec_start_loc')
-    for n in infec_start_locs:
-        neighb = nx.all_neighbors(g,n)
-        for nebs in neighb:
-            neighb_nodes.append(nebs)
+#the neighbours of all infection start locations
+def predict_next_infec_locations(cg):
+    infec = np.repeat(cg['infec_start_loc'], np.diff(cg['indptr']))
+    neighb_nodes = [cg['labels'][i] for i in cg['indices'][infec]]
 
     #we can also order these location edges by time by keeping locs that come into play
     #only after the 'infec_start_loc' time. This keeps predicted locs that were traveled
@@ -415,12 +2224,253 @@ def predict_next_infec_locations(g):
 
     return neighb_nodes
 
+#no of every node of a compact graph among the locations of its person (the digits its label
+#ends with)
+def compact_node_seq(cg):
+    return np.array([int(re.search(r'(\d+)$', lbl).group(1)) for lbl in cg['labels']], dtype=np.int64)
+
+#entry & exit times (minutes of the day) of every node of a compact graph, from the times on
+#its trajectory edges. The first location of a person is entered at the time of their first
+#reading (see first_readings) rather than at 0 as in the dwell table, so a contact can't start
+#before either of its readings. The last location has no exit time (0).
+def compact_dwell_times(cg):
+    seq = compact_node_seq(cg)
+    traj = (cg['etime'] >= 0) & ~cg['ebreach']
+    eu = cg['eu'][traj]
+    ev = cg['ev'][traj]
+    later = np.where(seq[eu] > seq[ev], eu, ev)
+    earlier = np.where(seq[eu] > seq[ev], ev, eu)
+    entmin = np.zeros(len(cg['labels']), dtype=np.int64)
+    extmin = np.zeros(len(cg['labels']), dtype=np.int64)
+    entmin[later] = hhmm_to_minutes(cg['etime'][traj])
+    extmin[earlier] = hhmm_to_minutes(cg['etime'][traj])
+    first = np.nonzero(seq == 0)[0]
+    entmin[first] = hhmm_to_minutes([first_readings.get(cg['names'][p], 0) for p in cg['person'][first]])
+    return entmin, extmin
+
+#traces exposure from the people in infected through time respecting chains of contacts, up
+#to depth contacts deep. A contact is a breach of two people who were at their
+#locations at the same time (the test for high risk, with the first location of a person
+#entered when it was recorded, see compact_dwell_times), and can pass exposure on at any
+#time from the start to the end of their time overlap. Returns a dataframe with the earliest
+#time every reached person can have been exposed (hhmm), the no of contacts (hops) from a
+#known infected person on the chain that gets there that early and the person it came from
+#(via). A longer chain can get there earlier than a direct contact.
+#All contacts are one event stream sorted by start time, processed a hop at a time for all
+#infected people at once: hop h finds the earliest exposure over at most h contacts from the
+#exposures of hop h-1, which makes it O(depth * contacts).
+def trace_exposure(cg, infected, depth):
+    entmin, extmin = compact_dwell_times(cg)
+    bu = cg['eu'][cg['ebreach']]
+    bv = cg['ev'][cg['ebreach']]
+    start = np.maximum(entmin[bu], entmin[bv])
+    end = np.minimum(extmin[bu], extmin[bv])
+    keep = start <= end
+    #every contact passes exposure both ways
+    src = np.concatenate([cg['person'][bu][keep], cg['person'][bv][keep]])
+    dst = np.concatenate([cg['person'][bv][keep], cg['person'][bu][keep]])
+    start = np.concatenate([start[keep], start[keep]])
+    end = np.concatenate([end[keep], end[keep]])
+    #ties go to the person that comes first by name, whatever order the graph is in
+    order = np.lexsort((dst, src, start))
+    src = src[order]
+    dst = dst[order]
+    start = start[order]
+    end = end[order]
+
+    never = np.iinfo(np.int64).max
+    exposed = np.full(len(cg['names']), never, dtype=np.int64)
+    hops = np.full(len(cg['names']), -1, dtype=np.int64)
+    via = np.full(len(cg['names']), -1, dtype=np.int64)
+    sources = [cg['names'].index(p) for p in infected if p in cg['names']]
+    exposed[sources] = -1
+    hops[sources] = 0
+    for h in range(1, depth + 1):
+        reach = np.nonzero(exposed[src] <= end)[0]
+        arrival = np.maximum(exposed[src[reach]], start[reach])
+        new = exposed.copy()
+        np.minimum.at(new, dst[reach], arrival)
+        improved = new < exposed
+        if(not improved.any()):
+            break
+        #the person an exposure came from is that of its first contact in the stream
+        first = reach[::-1][((arrival == new[dst[reach]]) & improved[dst[reach]])[::-1]]
+        via[dst[first]] = src[first]
+        hops[improved] = h
+        exposed = new
+
+    reached = np.nonzero(hops > 0)[0]
+    reached = reached[np.lexsort((exposed[reached], hops[reached]))]
+    names = np.array(cg['names'], dtype=object)
+    return pd.DataFrame(OrderedDict([('person', names[reached]),
+        ('exposed_at', minutes_to_hhmm(exposed[reached])),
+        ('hops', hops[reached]), ('via', names[via[reached]])]))
+
+#prints the exposure of the population to the known infected people (see trace_exposure)
+def find_exposed_ppl(cg):
+    exposure = trace_exposure(cg, known_infected_list, exposure_depth)
+    metrics['exposed'] = len(exposure)
+    printcov("People exposed to known infected people within: " + str(exposure_depth)
+        + " contacts (earliest time, contacts & who from): ")
+    print(exposure.to_string(index=False))
+    return exposure
+
+#saves the contact index (see contact_index_path) of a compact graph & the exposure found for
+#it, replacing any earlier one. It has four columns folders:
+# - people: name, sick, first visit & no of visits, and exposed_at, hops & via (person id,
+#   -1 = none) from the exposure. hops is -1 for people who were not reached.
+# - visits: the locations of every person in order (person, seq, lat, lon, entry, exit). The
+#   contacts of visit i are rows contact_offsets[i]:contact_offsets[i+1] of contacts.
+# - contacts: every breach from both sides (visit, other visit, start & end of their time
+#   overlap (hhmm, -1 = no overlap), high_risk & distance (km)), by visit and start time.
+# - cells: the dwell index grid cells (key, first, count) in key order, pointing into the
+#   visits of visits' by_cell array. grid.npy holds the cell size, origin & key span.
+def save_contact_index(cg, exposure):
+    if(os.path.isdir(contact_index_path)):
+        shutil.rmtree(contact_index_path)
+    os.makedirs(contact_index_path)
+    seq = compact_node_seq(cg)
+    entmin, extmin = compact_dwell_times(cg)
+    order = np.lexsort((seq, cg['person']))
+    visitof = np.empty(len(order), dtype=np.int64)
+    visitof[order] = np.arange(len(order))
+    person = cg['person'][order]
+    lat = cg['lat'][order]
+    lon = cg['lon'][order]
+
+    #breaches marked from both anchors are one contact
+    bu = visitof[cg['eu'][cg['ebreach']]]
+    bv = visitof[cg['ev'][cg['ebreach']]]
+    keys = np.unique(np.concatenate([bu * len(order) + bv, bv * len(order) + bu]))
+    a = keys // len(order)
+    b = keys % len(order)
+    start = np.maximum(entmin[order][a], entmin[order][b])
+    end = np.minimum(extmin[order][a], extmin[order][b])
+    overlap = start <= end
+    sick = np.array([n in set(known_infected_list) for n in cg['names']], dtype=bool)
+    contacts = pd.DataFrame(OrderedDict([('visit', a), ('other', b),
+        ('start', np.where(overlap, minutes_to_hhmm(start), -1)),
+        ('end', np.where(overlap, minutes_to_hhmm(end), -1)),
+        ('high_risk', (overlap & (sick[person[a]] | sick[person[b]])).astype(np.int64)),
+        ('distance', vincenty_distance(lat[a], lon[a], lat[b], lon[b]))]))
+    contacts = contacts.iloc[np.lexsort((contacts['other'].values, contacts['start'].values,
+        contacts['visit'].values))]
+    save_columns(contacts, os.path.join(contact_index_path, 'contacts'))
+
+    grid = np.array(grid_cell_size(microcell_radius, np.abs(lat).max() if len(lat) else 0)
+        + (lat.min() if len(lat) else 0, lon.min() if len(lon) else 0, index_key_span))
+    np.save(os.path.join(contact_index_path, 'grid.npy'), grid)
+    cells = index_cell_keys(lat, lon, grid)
+    bycell = np.argsort(cells, kind='mergesort')
+    cellkeys, cellfirst, cellcount = np.unique(cells[bycell], return_index=True, return_counts=True)
+    save_columns(pd.DataFrame(OrderedDict([('first', cellfirst), ('count', cellcount)])),
+        os.path.join(contact_index_path, 'cells'), {}, {'key': cellkeys})
+
+    contact_offsets = np.searchsorted(contacts['visit'].values, np.arange(len(order) + 1))
+    save_columns(pd.DataFrame(OrderedDict([('person', person), ('seq', seq[order]), ('lat', lat),
+        ('lon', lon), ('entry', minutes_to_hhmm(entmin[order])), ('exit', minutes_to_hhmm(extmin[order]))])),
+        os.path.join(contact_index_path, 'visits'), {},
+        {'contact_offsets': contact_offsets.astype(np.int64), 'by_cell': bycell.astype(np.int64)})
+
+    pidof = dict((cg['names'][p], p) for p in range(0, len(cg['names'])))
+    exposed_at = np.full(len(cg['names']), -1, dtype=np.int64)
+    hops = np.full(len(cg['names']), -1, dtype=np.int64)
+    via = np.full(len(cg['names']), -1, dtype=np.int64)
+    for r in exposure.itertuples():
+        exposed_at[pidof[r.person]] = r.exposed_at
+        hops[pidof[r.person]] = r.hops
+        via[pidof[r.person]] = pidof[r.via]
+    hops[sick] = 0
+    counts = np.bincount(person, minlength=len(cg['names']))
+    save_columns(pd.DataFrame(OrderedDict([('name', np.array(cg['names'], dtype=object)),
+        ('sick', sick.astype(np.int64)), ('first', np.concatenate([[0], np.cumsum(counts)[:-1]])),
+        ('count', counts), ('exposed_at', exposed_at), ('hops', hops), ('via', via)])),
+        os.path.join(contact_index_path, 'people'))
+    printcov("Saved contact index of: " + str(len(cg['names'])) + " people, " + str(len(order))
+        + " visits and: " + str(len(contacts)) + " contacts to: " + contact_index_path)
+    return
+
+#validates trace_exposure against the graph: the people exposed by a single contact have an
+#infection start location (the high risk test also counts the time before a person's first
+#reading), and all of them are exposed at any depth. No one is exposed before the first
+#reading of either person of the contact it came through.
+def test_exposure(cg, exposure):
+    printcov("=========> Testing exposure: ")
+    marked = set(cg['names'][p] for p in cg['person'][cg['infec_start_loc']])
+    direct = set(trace_exposure(cg, known_infected_list, 1)['person'])
+    assert direct <= marked, "exposure"
+    assert direct <= set(exposure['person']), "exposure depth"
+    for r in exposure.itertuples():
+        assert r.exposed_at >= max(first_readings.get(r.person, 0),
+            first_readings.get(r.via, 0)), "exposure time of: " + str(r.person)
+    printcov("=========> Testing complete.")
+    return
+
+#the graph the communities are found on, as set by community_graph, from biggx g and its
+#compact form cg (see compact_graph). Edges are weighted by the no of breaches they stand for.
+def community_input_graph(g, cg):
+    if(community_graph == 'locations'):
+        return g
+    eu = cg['eu'][cg['ebreach']]
+    ev = cg['ev'][cg['ebreach']]
+    if(community_graph == 'people'):
+        labels = cg['names']
+        nodes = range(0, len(labels))
+        eu = cg['person'][eu]
+        ev = cg['person'][ev]
+    else:
+        labels = cg['labels']
+        nodes = np.nonzero(cg['breached'])[0]
+    n = len(labels)
+    pairs, weights = np.unique(np.minimum(eu, ev) * n + np.maximum(eu, ev), return_counts=True)
+    gc = nx.Graph()
+    gc.add_nodes_from([labels[i] for i in nodes])
+    gc.add_weighted_edges_from([(labels[pairs[k] // n], labels[pairs[k] % n], int(weights[k]))
+        for k in range(0, len(pairs))])
+    return gc
+
+#the communities saved by the run before this one (see communities_path) for the nodes of G,
+#to start the community detection from. None if this is not an incremental run or there are
+#no communities of the same community_graph.
+def load_communities(G):
+    if(delta_path == '' or not os.path.exists(communities_path)):
+        return None
+    f = open(communities_path)
+    saved = json.load(f)
+    f.close()
+    if(saved['graph'] != community_graph):
+        return None
+    nextcom = max(list(saved['partition'].values()) + [-1]) + 1
+    partition = {}
+    for node in G.nodes():
+        if(node in saved['partition']):
+            partition[node] = saved['partition'][node]
+        else:
+            partition[node] = nextcom
+            nextcom = nextcom + 1
+    printcov("Starting community detection from the: " + str(len(set(partition.values())))
+        + " communities in: " + communities_path)
+    return partition
+
+#saves the communities of this run to communities_path, for the next incremental run
+def save_communities(partition):
+    f = open(communities_path, 'w')
+    json.dump({'graph': community_graph, 'partition': partition}, f)
+    f.close()
+    return
+
+#finds louvain communities on the graph set by community_graph. Returns them as lists of
+#location nodes of biggx g (cg is its compact form).
 #note: this function plots a graph if ui is enabled
-def find_communities_based_on_loc(g):
+def find_communities_based_on_loc(g, cg):
 
     #first compute the best partition
-    G = g
-    partition = community.best_partition(G)
+    G = community_input_graph(g, cg)
+    printcov("Finding communities on the: " + community_graph + " graph of: "
+        + str(G.number_of_nodes()) + " nodes and: " + str(G.number_of_edges()) + " edges.")
+    partition = community.best_partition(G, partition=load_communities(G),
+        random_state=(None if community_seed == -1 else community_seed))
+    save_communities(partition)
 
     comm_list = []    
     size = float(len(set(partition.values())))
@@ -440,32 +2490,39 @@ def find_communities_based_on_loc(g):
         nx.draw_networkx_edges(G, pos, alpha=0.5)
         plt.show()
 
-    printcov("Final list of: " + len(comm_list) + " louvain modularized communities :=>\n")
+    #communities of people hold the locations of their people
+    if(community_graph == 'people'):
+        order = np.argsort(cg['person'], kind='mergesort')
+        bounds = np.searchsorted(cg['person'][order], np.arange(len(cg['names']) + 1))
+        pidof = dict((cg['names'][p], p) for p in range(0, len(cg['names'])))
+        comm_list = [[cg['labels'][i] for p in comm
+            for i in order[bounds[pidof[p]]:bounds[pidof[p]+1]]] for comm in comm_list]
+
+    metrics['communities'] = len(comm_list)
+    printcov("Final list of: " + str(len(comm_list)) + " louvain modularized communities :=>\n")
     for x in comm_list:
         print(x)
     
     return comm_list
 
-def find_vuln_loc_and_ppl(comm_list, infperson):
+#communities holding a location of infperson are vulnerable, and so are all people with a
+#location in them. The people of the locations come from the compact graph cg.
+def find_vuln_loc_and_ppl(comm_list, infperson, cg):
 
     vulncomm = [] #list of vulnerable locations
-    for comm in comm_list:
-        for p in comm:
-            onlyname = ''.join([i for i in p if not i.isdigit()])
-            if(onlyname == infperson):
+    vulnppl1 = []
+    if(infperson in cg['names']):
+        pid = cg['names'].index(infperson)
+        for comm in comm_list:
+            people = cg['person'][[cg['idof'][p] for p in comm]]
+            if((people == pid).any()):
                 vulncomm.append(comm)
-                break
+                vulnppl1.extend(people)
     printcov("Priority list of vulnerable locations are: ")
     print(vulncomm)
-    
-    vulnppl1 = []
-    for x in vulncomm:
-        for j in range(0,len(x)):
-            onlyname = ''.join([i for i in x[j] if not i.isdigit()])
-            vulnppl1.append(onlyname)
 
     printcov("Vulnerable people are: ")
-    vulnppl = list(set(vulnppl1))
+    vulnppl = list(set([cg['names'][p] for p in vulnppl1]))
     print(vulnppl)
 
     return vulncomm, vulnppl
@@ -475,60 +2532,266 @@ def find_known_infected_ppl(g):
     print(known_infected_list)
     return known_infected_list
 
+#runs the analysis on g. All but the community detection run on the compact form of g (see
+#compact_graph).
 def run_graph_analysis(g):
     
-    infperson_lst = find_known_infected_ppl(g)
+    cg = timed_stage('compact_graph', compact_graph, g)
+    test_compact_graph(g, cg)
+
+    infperson_lst = timed_stage('find_known_infected_ppl', find_known_infected_ppl, g)
     
-    find_infection_start_locs(g)
+    timed_stage('find_infection_start_locs', find_infection_start_locs, cg)
     
-    find_high_traffic_locations(g)
+    timed_stage('find_high_traffic_locations', find_high_traffic_locations, cg)
     
-    predict_next_infec_locations(g)
+    timed_stage('predict_next_infec_locations', predict_next_infec_locations, cg)
+
+    exposure = timed_stage('find_exposed_ppl', find_exposed_ppl, cg)
+    test_exposure(cg, exposure)
+    timed_stage('save_contact_index', save_contact_index, cg, exposure)
     
-    comm_list = find_communities_based_on_loc(g)
+    comm_list = timed_stage('find_communities_based_on_loc', find_communities_based_on_loc, g, cg)
 
-    for infp in infperson_lst:
-        onlyname = ''.join([i for i in infp if not i.isdigit()])
-        find_vuln_loc_and_ppl(comm_list, onlyname)
+    timed_stage('find_vuln_loc_and_ppl', lambda: [find_vuln_loc_and_ppl(comm_list,
+        ''.join([i for i in infp if not i.isdigit()]), cg) for infp in infperson_lst])
 
     return
 
 ################
 ##### MAIN #####
 ################
+parser = argparse.ArgumentParser(description='Covid 19 contact tracing analysis.')
+parser.add_argument('--workers', type=int, default=workers,
+    help='no of worker processes for the overlap pass (default: ' + str(workers) + ')')
+parser.add_argument('--test-workers', action='store_true',
+    help='check the pooled overlap pass against a serial one (see test_workers)')
+parser.add_argument('--delta', default=delta_path, metavar='PATH',
+    help='incremental mode: add the readings in PATH to the results in the current folder')
+parser.add_argument('--shard', type=int, default=None, metavar='K',
+    help='only run shard K of the shard_tiles tiles on the prepped data and exit')
+parser.add_argument('--datapath', default=datapath, metavar='PATH',
+    help='data file (or prepped data folder) to analyse (default: ' + datapath + ')')
+parser.add_argument('--radius', type=float, default=microcell_radius, metavar='KM',
+    help='microcell radius in km (default: ' + str(microcell_radius) + ')')
+parser.add_argument('--radii', default=','.join([str(r) for r in microcell_radii]), metavar='KM,KM,..',
+    help='evaluate several microcell radii in one pass (see microcell_radii)')
+parser.add_argument('--storage', default=storage_format, choices=['csv', 'npy'],
+    help='format of the intermediate files (default: ' + storage_format + ')')
+parser.add_argument('--export-csv', action='store_true',
+    help='with --storage npy, also export the intermediate files to csv')
+parser.add_argument('--stable-sort', action='store_true',
+    help='keep the file order of readings with the same time (see stable_time_sort)')
+parser.add_argument('--prep-only', action='store_true',
+    help='only prep the data (see --storage) and exit')
+parser.add_argument('--engine', default=overlap_engine, choices=['brute', 'grid', 'sweep', 'shard'],
+    help='overlap engine (default: ' + overlap_engine + ')')
+parser.add_argument('--kernel', default=distance_kernel, choices=['latlon', 'numpy'],
+    help='distance kernel (default: ' + distance_kernel + ')')
+parser.add_argument('--communities', default=community_graph, choices=['locations', 'breaches', 'people'],
+    help='graph the communities are found on (default: ' + community_graph + ')')
+parser.add_argument('--community-seed', type=int, default=community_seed, metavar='N',
+    help='seed of the community detection, -1 = random (default: ' + str(community_seed) + ')')
+parser.add_argument('--exposure-depth', type=int, default=exposure_depth, metavar='N',
+    help='no of contacts exposure is traced through (default: ' + str(exposure_depth) + ')')
+parser.add_argument('--cache', default=cache_path, metavar='PATH',
+    help='folder of the artifact cache (default: ' + cache_path + ')')
+parser.add_argument('--cache-max-mb', type=int, default=cache_max_mb, metavar='MB',
+    help='size limit of the artifact cache, 0 = no cache (default: ' + str(cache_max_mb) + ')')
+parser.add_argument('--metrics', default=metrics_path, metavar='FILE',
+    help='save the timings of every stage & the counters of the run to FILE as json')
+parser.add_argument('--log-level', default=log_level, choices=['debug', 'info'],
+    help='how much is printed (default: ' + log_level + ')')
+parser.add_argument('--no-pause', action='store_true',
+    help='start right away instead of pausing to show the configurations')
+args = parser.parse_args()
+overlap_engine = args.engine
+distance_kernel = args.kernel
+if(args.metrics != ''):
+    metrics_path = os.path.abspath(args.metrics)
+log_level = args.log_level
+debug_output = (log_level == 'debug')
+workers = args.workers
+if(args.test_workers):
+    test_workers = 1
+delta_path = args.delta
+community_graph = args.communities
+community_seed = args.community_seed
+exposure_depth = args.exposure_depth
+cache_path = args.cache
+cache_max_mb = args.cache_max_mb
+datapath = args.datapath
+microcell_radius = args.radius
+if(args.radii != ''):
+    microcell_radii = [float(r) for r in args.radii.split(',')]
+if(len(microcell_radii) > 0):
+    microcell_radius = max(microcell_radii)
+storage_format = args.storage
+if(args.export_csv):
+    export_csv = 1
+if(args.stable_sort):
+    stable_time_sort = 1
+if(args.shard is not None):
+    run_shard(args.shard)
+    sys.exit(0)
+
 printcov("Starting Covid 19 contact tracing analysis for data in: ")
 printcov(" " + datapath)
 printcov("Configurations are: ")
 print("Microcell radius for overlap calc: " + str(microcell_radius))
+if(len(microcell_radii) > 0):
+    print("Microcell radii evaluated: " + str(sorted(microcell_radii)))
 print("Graph display control is: " + str(ui) + ".   0 = ON / 1 = OFF.")
+print("Overlap worker processes: " + str(workers))
+print("Communities found on: " + community_graph + " graph (seed: " + str(community_seed) + ")")
+print("Artifact cache: " + (cache_path + " (max: " + str(cache_max_mb) + " MB)" if cache_max_mb > 0 else "off"))
 print('-------------------------------------')
-time.sleep(7.7)
+if(not args.no_pause):
+    time.sleep(7.7)
+
+if(delta_path != ''):
+    if(len(microcell_radii) > 0):
+        raise ValueError("Incremental mode works with a single microcell radius only.")
+    write_output_stamp('')
+    biggx = read_graph_from_pickle("graph.gz")
+    travel_hist, known_infected_list = trace_delta(delta_path)
+    printcov("There are : " + str(len(travel_hist)) + " new travel histories. They are: ")
+    print(travel_hist)
+    save_travel_hist(travel_hist, "travelhist_delta_df")
+    save_graph_to_pickle(biggx, "graph.gz")
+    run_graph_analysis(biggx)
+    metrics['nodes'] = biggx.number_of_nodes()
+    metrics['edges'] = biggx.number_of_edges()
+    print_metrics()
+    printcov("Completed Covid 19 contact tracing analysis of new readings.")
+    sys.exit(0)
+
+#the artifacts of a run on the same data with the same parameters are loaded from the cache
+#and only the analysis is run. The outputs in the current folder are only saved again if they
+#are of another run or some of them are missing.
+cache_key = ''
+if(cache_max_mb > 0 and len(microcell_radii) == 0 and not args.prep_only):
+    cache_params = timed_stage('hash_inputs', artifact_params)
+    cache_key = artifact_key(cache_params)
+    output_stamp = cache_key + ' ' + storage_format + ' ' + str(export_csv)
+if(cache_key != '' and artifacts_cached(cache_key)):
+    printcov("Inputs unchanged, loading artifacts: " + artifact_path(cache_key))
+    sorteddf, dwell_table, biggx = timed_stage('load_artifacts', load_artifacts, cache_key)
+    known_infected_list = (sorteddf.loc[sorteddf['condition'] == 'sick'])['name'].unique()
+    first_readings.update(sorteddf.groupby('name', sort=False)['time'].first().to_dict())
+    if(read_output_stamp() != output_stamp or not outputs_saved()):
+        write_output_stamp('')
+        travel_hist = timed_stage('load_artifact_travel_hist', load_artifact_travel_hist, cache_key)
+        if(not is_prepped_columns(datapath)):
+            timed_stage('save_prepped', save_prepped, sorteddf)
+        timed_stage('save_travel_hist', save_travel_hist, travel_hist)
+        timed_stage('save_dwell_index', save_dwell_index, dwell_table, sorteddf)
+        timed_stage('save_graph_to_pickle', save_graph_to_pickle, biggx, "graph.gz")
+        write_output_stamp(output_stamp)
+    run_graph_analysis(biggx)
+    metrics['nodes'] = biggx.number_of_nodes()
+    metrics['edges'] = biggx.number_of_edges()
+    print_metrics()
+    printcov("Completed Covid 19 contact tracing analysis (cached artifacts).")
+    sys.exit(0)
 
 #call dataprep method. We also get 'persons' during this
-sorteddf = dataprep()
+write_output_stamp('')
+sorteddf = timed_stage('dataprep', dataprep)
+if(args.prep_only):
+    printcov("Completed data prep.")
+    sys.exit(0)
 
 known_infected_list = (sorteddf.loc[sorteddf['condition'] == 'sick'])['name'].unique()
+first_readings.update(sorteddf.groupby('name', sort=False)['time'].first().to_dict())
 printcov("We have: " + str(len(known_infected_list)) + " known infected people in this dataset. They are: ")
 print(known_infected_list)
 
 #call graph generation method for each person in the dataset
 print("Initiating graph generation...")
-for person in range(0,len(persons)):
-    graph_per_person(persons[person])
-
-test_all_graphs(gxarry_pop_travel_hist)
-
-biggx = build_bigdaddy(gxarry_pop_travel_hist)
-
-travel_hist = overlaps_for_pop(gxarry_pop_travel_hist)
+timed_stage('graph_per_person', lambda: [graph_per_person(p) for p in persons])
+
+if(debug_output):
+    test_all_graphs(gxarry_pop_travel_hist)
+
+dwell_table = timed_stage('build_dwell_table', build_dwell_table, dwell_parts)
+metrics['people'] = len(persons)
+metrics['locations'] = len(dwell_table['pid'])
+test_dwell_table(gxarry_pop_travel_hist)
+if(distance_kernel == 'numpy'):
+    test_distance_kernel(gxarry_pop_travel_hist)
+if(workers > 1):
+    overlap_pool = start_overlap_pool()
+    test_overlap_pool(overlap_pool, gxarry_pop_travel_hist)
+
+biggx = timed_stage('build_bigdaddy', build_bigdaddy, gxarry_pop_travel_hist)
+if(len(microcell_radii) > 0 or cache_key != ''):
+    breach_log = []
+if(overlap_pool is not None and test_workers == 1):
+    pregx = biggx.copy()
+
+travel_hist = timed_stage('overlaps_for_pop', overlaps_for_pop, gxarry_pop_travel_hist)
+if(overlap_pool is not None):
+    if(test_workers == 1):
+        timed_stage('test_pooled_overlaps', test_pooled_overlaps, gxarry_pop_travel_hist, travel_hist, pregx)
+    overlap_pool.close()
+    overlap_pool.join()
 printcov("There are : " + str(len(travel_hist)) + " travel histories. They are: ")
 print(travel_hist)
+
+#one set of results per radius, each in its own folder. The analysis output of a radius goes
+#to a file in its folder. biggx of each radius is built again rather than copied, as a copy
+#iterates its nodes & neighbours in another order on python 2 and the communities depend on
+#that order. Built & marked in the same order as a run with that radius alone, it gives the
+#same analysis too. The counters of the pass that depend on the radius are kept per radius.
+if(len(microcell_radii) > 0):
+    log = breach_log
+    breach_log = None
+    for name in ['breaches', 'high_risk']:
+        metrics.pop(name, None)
+    for microcell_radius in sorted(microcell_radii):
+        biggx = build_bigdaddy(gxarry_pop_travel_hist)
+        marked = replay_breaches(log, microcell_radius)
+        th = travel_hist_for_radius(travel_hist, microcell_radius)
+        printcov("Microcell radius: " + str(microcell_radius) + " has: " + str(marked)
+            + " breaches (high risk: " + str((th['risk'] == 'high').sum()) + "). Saving results to: "
+            + radius_folder(microcell_radius))
+        metrics['radius ' + str(microcell_radius)] = OrderedDict([('breaches', marked),
+            ('high_risk', int((th['risk'] == 'high').sum())), ('nodes', biggx.number_of_nodes()),
+            ('edges', biggx.number_of_edges())])
+        if(not os.path.isdir(radius_folder(microcell_radius))):
+            os.makedirs(radius_folder(microcell_radius))
+        os.chdir(radius_folder(microcell_radius))
+        save_travel_hist(th)
+        save_dwell_index(dwell_table, sorteddf)
+        save_graph_to_pickle(biggx, "graph.gz")
+        stdout = sys.stdout
+        sys.stdout = open("analysis_output_mcradius-" + str(microcell_radius) + "mt.txt", 'w')
+        run_graph_analysis(biggx)
+        sys.stdout.close()
+        sys.stdout = stdout
+        for name in ['exposed', 'communities']:
+            metrics['radius ' + str(microcell_radius)][name] = metrics.pop(name)
+        os.chdir('..')
+    print_metrics()
+    printcov("Completed Covid 19 contact tracing analysis for: " + str(len(microcell_radii))
+        + " microcell radii.")
+    sys.exit(0)
+
 #save travel hist for later use
-travel_hist.to_csv("travelhist_df.csv")
+timed_stage('save_travel_hist', save_travel_hist, travel_hist)
+timed_stage('save_dwell_index', save_dwell_index, dwell_table, sorteddf)
 disp_graph(biggx)
 
-save_graph_to_pickle(biggx, "graph.gz")
+timed_stage('save_graph_to_pickle', save_graph_to_pickle, biggx, "graph.gz")
+if(cache_key != ''):
+    timed_stage('save_artifacts', save_artifacts, cache_key, cache_params, gxarry_pop_travel_hist,
+        breach_log)
+    write_output_stamp(output_stamp)
 
 run_graph_analysis(biggx)
+metrics['nodes'] = biggx.number_of_nodes()
+metrics['edges'] = biggx.number_of_edges()
+print_metrics()
 
 printcov("Completed Covid 19 contact tracing analysis.")
@@ -30,9 +30,15 @@ import decimal
 import string
 import datetime
 import pandas as pd
+import numpy as np
 import LatLon
 from LatLon import *
 import time
+import os
+import resource
+import argparse
+from collections import deque
+from multiprocessing import Pool
 
 ##### all configurables start here #####
 
@@ -88,6 +94,44 @@ total_linger_start_loc = 7
 #vendors etc).
 linger_mov_angle_mulfactor = 15
 
+#selects how the data is generated.
+#'classic' = person by person, each reading built with LatLon & datetime and appended to a
+#            dataframe.
+#'numpy'   = the whole population in one go as numpy arrays. Linger paths are stepped with a
+#            closed form destination point on the WGS84 ellipsoid instead of LatLon.offset.
+#            Same configurables & same kind of data, only much faster for large populations.
+generation_engine = 'classic'
+
+#no of people generated & written at a time. 0 = generate everyone, then write one csv file.
+#Anything else streams the population out in batches of this many people (always with the
+#'numpy' engine), so memory use stays flat whatever total_pop is. Progress is reported once
+#per batch instead of once per person. Can also be set with --batch N.
+generation_batch = 0
+
+#only used when generation_batch > 0.
+#'csv' = batches are appended to cov19_gen_dataset.csv.
+#'npy' = batches are appended to a folder cov19_gen_dataset holding one .npy file per column,
+#        in the columns layout of cov19_con_trace.py (see save_columns there), which reads the
+#        folder as its datapath: name, date & condition as integer codes plus a file of their
+#        text (categories), lat & lon as float64, time as int32 (hhmm).
+#Can also be set with --format.
+generation_format = 'csv'
+
+#seed for the random numbers. -1 = a different dataset on every run. Anything else makes the
+#run repeatable: with the 'numpy' engine every batch draws from its own stream derived from
+#this seed & the batch no, so the same seed, generation_batch & generation_date give byte
+#identical output whatever generation_workers is. The 'classic' engine just seeds random.
+generation_seed = -1
+
+#no of worker processes generating batches in parallel (only with generation_batch > 0).
+#0 or 1 = generate in this process. Batches are still written in order. Can also be set with
+#--workers N.
+generation_workers = 0
+
+#date stamped on the readings by the 'numpy' engine, as dd-mm-yyyy. '' = today. Set it to
+#regenerate a seeded dataset exactly on a later day. Can also be set with --date.
+generation_date = ''
+
 ##### all configurables end here #####
 
 #dataframe that holds all regiemented (linger) start locations
@@ -108,6 +152,14 @@ mark_sick = 0
 glinger = False
 reglocindex = 0
 
+#WGS84 ellipsoid (same as the LatLon default) used by the 'numpy' engine. a in km.
+wgs84_a = 6378.137
+wgs84_f = 1 / 298.257223563
+wgs84_e2 = wgs84_f * (2 - wgs84_f)
+
+#distance (km) a lingering person moves between two readings
+linger_step = 0.002
+
 ##### Non main methods #####
 
 #calls generations for either linger or passthru
@@ -215,8 +267,293 @@ def random_datagen(name, condition):
 	#print(dfrandom)
 	return dfrandom
 
+#closed form destination point of a short step of d km on a heading (radians, clockwise
+#from north) from lat, lon (degrees, numpy arrays) on the WGS84 ellipsoid. Uses the radii of
+#curvature at the middle of the step, which is exact to well below a micrometre for steps of
+#a few metres.
+def destination_step(lat, lon, heading, d):
+	midlat = lat
+	for it in range(0, 2):
+		s2 = np.sin(np.radians(midlat)) ** 2
+		m = wgs84_a * (1 - wgs84_e2) / (1 - wgs84_e2 * s2) ** 1.5
+		n = wgs84_a / np.sqrt(1 - wgs84_e2 * s2)
+		dlat = np.degrees(d * np.cos(heading) / m)
+		midlat = lat + dlat / 2
+	dlon = np.degrees(d * np.sin(heading) / (n * np.cos(np.radians(midlat))))
+	return lat + dlat, lon + dlon
+
+#coordinates given as integer millionths of a degree, as text in the same form as the
+#'classic' engine writes them (a Decimal)
+def micro_to_str(v):
+	return [str(decimal.Decimal(int(x)) / 1000000) for x in np.ravel(v)]
+
+#unique names for people first .. first+n-1, without remembering earlier names. Person
+#numbers are mapped onto all possible names by a random affine permutation (mult & add, see
+#gen_name_perm), which never gives two people the same name.
+def index_names(first, n, mult, add):
+	space = name_space()
+	idx = (np.arange(first, first + n, dtype=np.int64) * mult + add) % space
+	codes = np.empty((n, name_size), dtype=np.uint8)
+	for c in range(0, name_size):
+		codes[:, c] = ord('A') + idx % 26
+		idx = idx // 26
+	return codes.view('S' + str(name_size)).ravel().tolist()
+
+#no of names index_names can hand out
+def name_space():
+	return min(26 ** name_size, 2 ** 62)
+
+#random permutation parameters for index_names, drawn from rng. mult is odd & not a multiple
+#of 13 so that it is coprime with the no of names.
+def gen_name_perm(rng):
+	mult = 2 * rng.randint(0, 2 ** 29) + 1
+	while(mult % 13 == 0):
+		mult = 2 * rng.randint(0, 2 ** 29) + 1
+	return int(mult), int(rng.randint(0, name_space(), dtype=np.int64))
+
+#unique random names for n people, drawn from rng
+def gen_names(n, rng):
+	letters = np.array(list(string.ascii_uppercase))
+	names = []
+	seen = set()
+	while(len(names) < n):
+		for row in letters[rng.randint(0, len(letters), (n - len(names), name_size))]:
+			name = ''.join(row)
+			if(name not in seen):
+				seen.add(name)
+				names.append(name)
+	return names
+
+#regimented start locations for the 'numpy' engine, as integer millionths of a degree
+def gen_reg_start_micro(rng):
+	nreg = min(total_linger_start_loc, 24)
+	return rng.randint(latstart, latend, nreg), rng.randint(lonstart, lonend, nreg)
+
+#the seed the random streams of this run are derived from (see generation_seed)
+def run_seed():
+	if(generation_seed >= 0):
+		return generation_seed
+	return random.SystemRandom().randrange(0, 2 ** 32)
+
+#random stream for one part of the generation, derived from the run seed & key (a list of
+#small ints, e.g. the batch no). 'global' = start locations & names, 'data' = the readings of
+#a batch, 'sick' = the sick draws of a batch. Kept apart so the sick draws of every batch can
+#be replayed cheaply to split the sick quota up front.
+def derived_rng(seed, part, key):
+	return np.random.RandomState([seed, ['global', 'data', 'sick'].index(part)] + list(key))
+
+#a person is sick on a draw of 15..20 out of 10..20 (till no_of_sick_allowed are sick)
+def sick_draws(rng, pop):
+	return rng.randint(10, 21, pop) >= 15
+
+#data gen with numpy for people first .. first+len(names)-1 of the population. People
+#alternate between linger & passthru and are assigned start locations (reglat, reglon, see
+#gen_reg_start_micro) and conditions the same way as the main loop does, with draws (see
+#sick_draws) and sick_left people still allowed to be sick. Everything else is drawn from
+#rng. Returns the data and the no of people marked sick.
+def vectorized_datagen(names, first, draws, sick_left, reglat, reglon, rng):
+	pop = len(names)
+	nreg = len(reglat)
+	date = generation_date
+	if(date == ''):
+		date = datetime.datetime.now().strftime("%d-%m-%Y")
+
+	sick = draws & (np.cumsum(draws) <= sick_left)
+	person = np.arange(first, first + pop)
+	linger = (person % 2) == 0
+	locindx = person % nreg
+
+	lats = np.empty((pop, total_readings), dtype=object)
+	lons = np.empty((pop, total_readings), dtype=object)
+	times = np.empty((pop, total_readings), dtype=object)
+
+	#passthru: random locations against random times
+	pt = np.nonzero(~linger)[0]
+	shape = (len(pt), total_readings)
+	lats[pt] = np.array(micro_to_str(rng.randint(latstart, latend, shape)), dtype=object).reshape(shape)
+	lons[pt] = np.array(micro_to_str(rng.randint(lonstart, lonend, shape)), dtype=object).reshape(shape)
+	timehr = rng.randint(timehr_range_start, timehr_range_end + 1, shape)
+	timemm = rng.randint(timemm_range_start, timemm_range_end + 1, shape)
+	times[pt] = np.core.defchararray.add(timehr.astype(str), timemm.astype(str)).astype(object)
+
+	#linger: a path from the person's regimented start location, one step per minute
+	li = np.nonzero(linger)[0]
+	lats[li, 0] = micro_to_str(reglat[locindx[li]])
+	lons[li, 0] = micro_to_str(reglon[locindx[li]])
+	heading = np.radians(locindx[li] * linger_mov_angle_mulfactor)
+	lat = reglat[locindx[li]] / 1000000.0
+	lon = reglon[locindx[li]] / 1000000.0
+	timehr = rng.randint(timehr_range_start, timehr_range_end + 1, len(li))
+	timemm = rng.randint(timemm_range_start, timemm_range_end + 1, len(li))
+	times[li, 0] = [str(h) + str(m) for h, m in zip(timehr, timemm)]
+	for r in range(1, total_readings):
+		lat, lon = destination_step(lat, lon, heading, linger_step)
+		lats[li, r] = ['%.12g' % x for x in lat]
+		lons[li, r] = ['%.12g' % x for x in lon]
+		minute = (timehr * 60 + timemm + r) % 1440
+		times[li, r] = ['%02d%02d' % (m // 60, m % 60) for m in minute]
+
+	return pd.DataFrame({'name': np.repeat(names, total_readings), 'lat': lats.ravel(),
+		'lon': lons.ravel(), 'date': date, 'time': times.ravel(),
+		'condition': np.repeat(np.where(sick, 'sick', 'healthy'), total_readings)},
+		columns = col_names, index = np.tile(np.arange(total_readings), pop)), sick.sum()
+
+#types of the .npy files batches are appended to by the 'npy' generation_format. name holds
+#the no of the person, whose name is that no in name_categories. date & condition are codes
+#into the fixed date_categories & condition_categories (see open_npy_columns).
+def npy_column_types():
+	return {'name': np.int32, 'name_categories': 'S' + str(name_size), 'lat': np.float64,
+		'lon': np.float64, 'date': np.int8, 'time': np.int32, 'condition': np.int8}
+
+#opens the .npy files of the 'npy' generation_format for rows rows of total_pop people, with
+#their headers written so that batches can be appended as raw data. The list of columns &
+#the categories of date (the one date of the readings) & condition are written right away.
+def open_npy_columns(path, rows, date):
+	if(not os.path.isdir(path)):
+		os.makedirs(path)
+	np.save(os.path.join(path, 'columns.npy'), np.array(col_names, dtype=np.string_))
+	np.save(os.path.join(path, 'date_categories.npy'), np.array([date], dtype=np.string_))
+	np.save(os.path.join(path, 'condition_categories.npy'), np.array(['healthy', 'sick'], dtype=np.string_))
+	files = {}
+	for col in npy_column_types():
+		f = open(os.path.join(path, col + '.npy'), 'wb')
+		np.lib.format.write_array_header_1_0(f, {'descr': np.lib.format.dtype_to_descr(
+			np.dtype(npy_column_types()[col])), 'fortran_order': False,
+			'shape': (total_pop if col == 'name_categories' else rows,)})
+		files[col] = f
+	return files
+
+#generates batch k of the population (people first .. first+n-1, see stream_datagen) and
+#returns it in the form it is written out in: csv text or the raw bytes of every .npy column.
+#Runs in the generation_workers processes as well, so it only uses what is in task.
+def gen_batch(task):
+	k, first, n, sick_left, seed, reglat, reglon, mult, add = task
+	names = index_names(first, n, mult, add)
+	df = vectorized_datagen(names, first, sick_draws(derived_rng(seed, 'sick', [k]), n), sick_left,
+		reglat, reglon, derived_rng(seed, 'data', [k]))[0]
+	if(generation_format == 'npy'):
+		cols = {'name': np.repeat(np.arange(first, first + n), total_readings), 'name_categories': names,
+			'lat': df['lat'].values, 'lon': df['lon'].values, 'date': np.zeros(len(df)),
+			'time': df['time'].values, 'condition': df['condition'].values == 'sick'}
+		return dict((col, np.asarray(cols[col]).astype(npy_column_types()[col]).tobytes()) for col in cols)
+	return df.to_csv(None, header=(first == 0))
+
+#writes the next batch (output of gen_batch, or its pending result from the pool) to files
+#and reports progress. done = no of people written before it. Returns the new done.
+def write_batch(files, out, done, started):
+	if(not isinstance(out, (str, dict))):
+		out = out.get()
+	if(generation_format == 'npy'):
+		for col in files:
+			files[col].write(out[col])
+	else:
+		files.write(out)
+	done = min(total_pop, done + generation_batch)
+	elapsed = time.time() - started
+	print("Generated: " + str(done) + " of " + str(total_pop) + " people ("
+		+ str(done * 100 // total_pop) + "%). " + str(int(done * total_readings / max(elapsed, 1e-6)))
+		+ " readings/s, " + str(int(elapsed)) + " s elapsed, about "
+		+ str(int(elapsed * (total_pop - done) / done)) + " s to go. Peak memory: "
+		+ str(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss // 1024) + " MB")
+	return done
+
+#generates the population in batches of generation_batch people with the 'numpy' engine and
+#appends each batch to the output (see generation_format) in order. The sick quota is split
+#between batches up front by replaying their sick draws, so that batches can be generated
+#independently, in generation_workers processes when configured.
+def stream_datagen():
+	global generation_date
+	if(total_pop > name_space()):
+		raise ValueError("total_pop is larger than the no of possible names. Raise name_size.")
+	seed = run_seed()
+	rng = derived_rng(seed, 'global', [])
+	reglat, reglon = gen_reg_start_micro(rng)
+	mult, add = gen_name_perm(rng)
+	#one date for all batches, even if the run goes past midnight
+	if(generation_date == ''):
+		generation_date = datetime.datetime.now().strftime("%d-%m-%Y")
+	tasks = []
+	drawn = 0
+	for k, first in enumerate(range(0, total_pop, generation_batch)):
+		n = min(generation_batch, total_pop - first)
+		tasks.append((k, first, n, no_of_sick_allowed - min(drawn, no_of_sick_allowed), seed,
+			reglat, reglon, mult, add))
+		drawn = drawn + sick_draws(derived_rng(seed, 'sick', [k]), n).sum()
+
+	if(generation_format == 'npy'):
+		files = open_npy_columns("cov19_gen_dataset", total_pop * total_readings, generation_date)
+	else:
+		files = open("cov19_gen_dataset.csv", 'w')
+	pool = None
+	inflight = 1
+	if(generation_workers > 1):
+		pool = Pool(generation_workers)
+		#at most two batches per worker are in flight, so memory stays bounded
+		inflight = generation_workers * 2
+	pending = deque()
+	done = 0
+	started = time.time()
+	for task in tasks:
+		if(pool is None):
+			pending.append(gen_batch(task))
+		else:
+			pending.append(pool.apply_async(gen_batch, (task,)))
+		if(len(pending) >= inflight):
+			done = write_batch(files, pending.popleft(), done, started)
+	while(len(pending) > 0):
+		done = write_batch(files, pending.popleft(), done, started)
+	if(pool is not None):
+		pool.close()
+		pool.join()
+	if(generation_format == 'npy'):
+		for col in files:
+			files[col].close()
+	else:
+		files.close()
+	return
+
 ##### main #####
 
+parser = argparse.ArgumentParser(description='Covid 19 contact tracing data generator.')
+parser.add_argument('--pop', type=int, default=total_pop,
+	help='total no of people (default: ' + str(total_pop) + ')')
+parser.add_argument('--sick-percent', type=int, default=sick_percent,
+	help='%% of the population that is sick (default: ' + str(sick_percent) + ')')
+parser.add_argument('--startloc', type=int, default=total_linger_start_loc,
+	help='no of regimented start locations (default: ' + str(total_linger_start_loc) + ')')
+parser.add_argument('--engine', default=generation_engine, choices=['classic', 'numpy'],
+	help='generation engine (default: ' + generation_engine + ')')
+parser.add_argument('--batch', type=int, default=generation_batch, metavar='N',
+	help='people generated & written at a time, 0 = all at once (default: ' + str(generation_batch) + ')')
+parser.add_argument('--format', default=generation_format, choices=['csv', 'npy'],
+	help='output format of batches (default: ' + generation_format + ')')
+parser.add_argument('--seed', type=int, default=generation_seed,
+	help='random seed, -1 = unseeded (default: ' + str(generation_seed) + ')')
+parser.add_argument('--workers', type=int, default=generation_workers,
+	help='no of worker processes generating batches (default: ' + str(generation_workers) + ')')
+parser.add_argument('--date', default=generation_date, metavar='DD-MM-YYYY',
+	help='date stamped on the readings by the numpy engine, \'\' = today (default: \''
+	+ generation_date + '\')')
+parser.add_argument('--no-pause', action='store_true',
+	help='start right away instead of pausing to show the configurations')
+args = parser.parse_args()
+if(args.pop != total_pop or args.sick_percent != sick_percent):
+	total_pop = args.pop
+	sick_percent = args.sick_percent
+	no_of_sick_allowed = max(1, (total_pop*sick_percent)/100)
+total_linger_start_loc = args.startloc
+generation_engine = args.engine
+generation_seed = args.seed
+generation_batch = args.batch
+generation_format = args.format
+generation_workers = args.workers
+generation_date = args.date
+if(generation_date != ''):
+	try:
+		datetime.datetime.strptime(generation_date, "%d-%m-%Y")
+	except ValueError:
+		parser.error("--date must be of the form dd-mm-yyyy: " + generation_date)
+
 print("Configurations are: ")
 print("------------------------------------")
 print("Total population: " + str(total_pop))
@@ -234,40 +571,64 @@ print(str(timemm_range_start))
 print(str(timemm_range_end))
 print("Number of start locations to be generated for regimented loc paths: " + str(total_linger_start_loc))
 print("Regimented loc path move bearing factor: " + str(linger_mov_angle_mulfactor))
+print("Generation engine: " + generation_engine)
+print("Generation seed: " + str(generation_seed))
+if(generation_batch > 0):
+	print("Generation batches: " + str(generation_batch) + " people, written as " + generation_format
+		+ " by: " + str(generation_workers) + " worker processes")
+if(generation_date != ''):
+	print("Generation date: " + generation_date)
 print('-------------------------------------')
-time.sleep(7)
+if(not args.no_pause):
+	time.sleep(7)
 
 print("Starting generation of data ...")
-reglocdf = gen_reg_start_loc(total_linger_start_loc)
-print("Regimented start locations are: ")
-print(reglocdf)
-
-for p in range(0, total_pop):
-	name = ''.join(random.choice(string.ascii_uppercase) for _ in range(name_size))
-	#print(name)
-	condition = "healthy"
-	if(mark_sick==0):
-		con = random.randint(10,20)
-		if(con>=15):
-			condition = "sick"
-			curr_sick = curr_sick + 1
-			if(curr_sick>=no_of_sick_allowed):
-				mark_sick = 1
-
-	#print("Person: " + name + " is: " + condition)
-	if(glinger):
-		glinger = False
-	else:
-		glinger = True
-
-	datasetdf = datasetdf.append(generate_dyndata(glinger,name,condition,reglocindex))
-	reglocindex = reglocindex + 1
-	if(reglocindex>=total_linger_start_loc):
-		reglocindex = 0
-
-	print("Generated data points for: " + str(p+1) + " people.")
-
-print("Completed generation...now writing to CSV file...")
-datasetdf.to_csv("cov19_gen_dataset.csv")
+if(generation_workers > 1 and generation_batch == 0):
+	raise ValueError("generation_workers needs generation_batch > 0.")
+if(generation_batch > 0):
+	stream_datagen()
+elif(generation_engine == 'numpy'):
+	seed = run_seed()
+	rng = derived_rng(seed, 'global', [])
+	reglat, reglon = gen_reg_start_micro(rng)
+	datasetdf, curr_sick = vectorized_datagen(gen_names(total_pop, rng), 0,
+		sick_draws(derived_rng(seed, 'sick', [0]), total_pop), no_of_sick_allowed, reglat, reglon,
+		derived_rng(seed, 'data', [0]))
+	print("Generated data points for: " + str(total_pop) + " people.")
+else:
+	if(generation_seed >= 0):
+		random.seed(generation_seed)
+	reglocdf = gen_reg_start_loc(total_linger_start_loc)
+	print("Regimented start locations are: ")
+	print(reglocdf)
+
+	for p in range(0, total_pop):
+		name = ''.join(random.choice(string.ascii_uppercase) for _ in range(name_size))
+		#print(name)
+		condition = "healthy"
+		if(mark_sick==0):
+			con = random.randint(10,20)
+			if(con>=15):
+				condition = "sick"
+				curr_sick = curr_sick + 1
+				if(curr_sick>=no_of_sick_allowed):
+					mark_sick = 1
+
+		#print("Person: " + name + " is: " + condition)
+		if(glinger):
+			glinger = False
+		else:
+			glinger = True
+
+		datasetdf = datasetdf.append(generate_dyndata(glinger,name,condition,reglocindex))
+		reglocindex = reglocindex + 1
+		if(reglocindex>=total_linger_start_loc):
+			reglocindex = 0
+
+		print("Generated data points for: " + str(p+1) + " people.")
+
+if(generation_batch == 0):
+	print("Completed generation...now writing to CSV file...")
+	datasetdf.to_csv("cov19_gen_dataset.csv")
 print("Wrote file. Generator will exit now.")
 #print(datasetdf)
@@ -0,0 +1,217 @@
+"""
+This program runs a sweep of scenarios through generator.py and cov19_con_trace.py. Every
+combination of the population, sick percentage and start location values below is one dataset,
+and every dataset is traced with every microcell radius below. The results are laid out the same
+way as the hand made dataset folders in this repo:
+
+cov19_gen_dataset_pop-10_sickper-03_startloc-10/
+    cov19_gen_dataset_pop-10_sickper-03_startloc-10.csv   (generated once per dataset)
+    preppd_df/                                             (prepp'd once per dataset)
+    microcell_radius_0.01metres/
+        cov19_gen_dataset_pop-10_sickper-03_startloc-10.csv
+        preppd_df-cov19_gen_dataset_pop-10_sickper-03_startloc-10.csv
+        graph-cov19_gen_dataset_pop-10_sickper-03_startloc-10.gz
+        analysis_output_mcradius-0.01mt.txt
+        travelhist_df.csv
+    microcell_radius_0.02metres/
+        ...
+
+plus sweep_summary.csv with the runtime and results of every scenario. The generated dataset
+and its prepp'd data don't depend on the radius, so they are only built once. They are also
+kept between sweeps and only rebuilt when the generator options change. All radii of a dataset
+are then traced in a single pass of cov19_con_trace.py (see microcell_radii there), which reads
+the prepp'd data as memory mapped columns. Jobs run as separate processes, sweep_workers at a
+time.
+
+Dependencies:
+ - Python 2.7 only (latlon doesn't support Python 3 :(.)
+ - the dependencies of generator.py and cov19_con_trace.py
+
+"""
+
+import os
+import sys
+import shutil
+import subprocess
+import time
+from multiprocessing import Pool
+import pandas as pd
+import networkx as nx
+
+##### All configurations start here #####
+
+#the datasets of the sweep. Every combination of these is one dataset.
+sweep_pop = [10, 30]
+sweep_sick_percent = [3, 5]
+sweep_startloc = [7, 10]
+
+#microcell radii (km) every dataset is traced with
+sweep_radius = [0.01, 0.02]
+
+#generation engine & seed for all datasets (see generation_engine & generation_seed in
+#generator.py). A seed makes the sweep repeatable.
+sweep_engine = 'numpy'
+sweep_seed = 1
+
+#extra command line options for every tracing job, e.g. ['--workers', '2']
+sweep_trace_options = []
+
+#no of jobs run at the same time
+sweep_workers = 2
+
+#folder the dataset folders & the summary are written to
+sweep_folder = 'sweep'
+
+##### All configurations end here   #####
+
+#the programs the sweep runs, next to this one
+code_folder = os.path.dirname(os.path.abspath(__file__))
+
+#the columns of the summary table. trace_secs is the time of the tracing pass shared by all
+#radii of a dataset.
+col_summary = ['dataset','pop','sick_percent','startloc','radius','status','gen_secs',
+    'prep_secs','trace_secs','known_infected','nodes','edges','breach_edges',
+    'infec_start_locs','breaches','high_risk']
+
+##### Non main methods #####
+
+#prints with the same marker as the other programs
+def printcov(str_to_print):
+    print("[log]:--> " + str_to_print)
+
+#name of a dataset, as in the dataset folders of this repo
+def dataset_name(pop, sick, startloc):
+    return ("cov19_gen_dataset_pop-%02d_sickper-%02d_startloc-%02d" % (pop, sick, startloc))
+
+#folder of one radius of a dataset
+def radius_folder(name, radius):
+    return os.path.join(sweep_folder, name, "microcell_radius_" + str(radius) + "metres")
+
+#runs one of the programs with args in folder, output going to logname in that folder.
+#Returns the wall time in seconds & whether it succeeded.
+def run_program(program, args, folder, logname):
+    log = open(os.path.join(folder, logname), 'w')
+    started = time.time()
+    rc = subprocess.call([sys.executable, os.path.join(code_folder, program)] + args,
+        cwd=folder, stdout=log, stderr=subprocess.STDOUT)
+    log.close()
+    return time.time() - started, rc == 0
+
+#links a file into another folder, or copies it where links are not possible
+def link_file(src, dst):
+    if(os.path.exists(dst)):
+        os.remove(dst)
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copyfile(src, dst)
+
+#generates & preps one dataset, unless the cached one in its folder was built with the same
+#generator options. Returns (name, status, gen secs, prep secs).
+def build_dataset(dataset):
+    pop, sick, startloc = dataset
+    name = dataset_name(pop, sick, startloc)
+    folder = os.path.join(sweep_folder, name)
+    if(not os.path.isdir(folder)):
+        os.makedirs(folder)
+    genargs = ['--no-pause', '--pop', str(pop), '--sick-percent', str(sick), '--startloc',
+        str(startloc), '--engine', sweep_engine, '--seed', str(sweep_seed)]
+    stamp = os.path.join(folder, "sweep_cache.txt")
+    if(os.path.exists(stamp) and open(stamp).read() == ' '.join(genargs)):
+        return name, 'cached', 0.0, 0.0
+    if(os.path.exists(stamp)):
+        os.remove(stamp)
+
+    gensecs, ok = run_program("generator.py", genargs, folder, "generator_output.txt")
+    if(not ok):
+        return name, 'generator failed', gensecs, 0.0
+    os.rename(os.path.join(folder, "cov19_gen_dataset.csv"), os.path.join(folder, name + ".csv"))
+    prepsecs, ok = run_program("cov19_con_trace.py", ['--no-pause', '--prep-only', '--storage',
+        'npy', '--export-csv', '--datapath', name + ".csv"], folder, "prep_output.txt")
+    if(not ok):
+        return name, 'prep failed', gensecs, prepsecs
+    f = open(stamp, 'w')
+    f.write(' '.join(genargs))
+    f.close()
+    return name, 'ok', gensecs, prepsecs
+
+#traces one dataset with all radii in one pass, reading the dataset's prepp'd data. The
+#outputs of every radius are renamed to the names used in the dataset folders of this repo.
+#Returns (status, secs).
+def trace_dataset(name):
+    folder = os.path.join(sweep_folder, name)
+    secs, ok = run_program("cov19_con_trace.py", ['--no-pause', '--datapath', 'preppd_df',
+        '--radii', ','.join([str(r) for r in sweep_radius])] + sweep_trace_options, folder,
+        "trace_output.txt")
+    if(not ok):
+        return 'trace failed', secs
+    for radius in sweep_radius:
+        rfolder = radius_folder(name, radius)
+        link_file(os.path.join(folder, name + ".csv"), os.path.join(rfolder, name + ".csv"))
+        link_file(os.path.join(folder, "preppd_df.csv"), os.path.join(rfolder, "preppd_df-" + name + ".csv"))
+        os.rename(os.path.join(rfolder, "graph.gz"), os.path.join(rfolder, "graph-" + name + ".gz"))
+    return 'ok', secs
+
+#results of one traced scenario, read from its output files
+def scenario_results(name, radius):
+    folder = radius_folder(name, radius)
+    g = nx.read_gpickle(os.path.join(folder, "graph-" + name + ".gz"))
+    th = pd.read_csv(os.path.join(folder, "travelhist_df.csv"), usecols=['breach','risk'])
+    data = pd.read_csv(os.path.join(folder, name + ".csv"), usecols=['name','condition'])
+    return {'known_infected': data.loc[data['condition'] == 'sick', 'name'].nunique(),
+        'nodes': g.number_of_nodes(), 'edges': g.number_of_edges(),
+        'breach_edges': sum(1 for e in g.edges(data=True) if 'breachnodes' in e[2]),
+        'infec_start_locs': sum(1 for n in g.nodes(data=True) if n[1].get('infec_start_loc') == 'yes'),
+        'breaches': (th['breach'] == 'yes').sum(), 'high_risk': (th['risk'] == 'high').sum()}
+
+#runs the whole sweep & writes the summary table
+def run_sweep():
+    datasets = [(p, s, l) for p in sweep_pop for s in sweep_sick_percent for l in sweep_startloc]
+    pool = Pool(sweep_workers)
+    printcov("Building: " + str(len(datasets)) + " datasets.")
+    built = {}
+    for (name, status, gensecs, prepsecs), dataset in zip(pool.imap(build_dataset, datasets), datasets):
+        printcov("Dataset: " + name + ": " + status + " (generated in: " + str(round(gensecs, 2))
+            + " s, prepp'd in: " + str(round(prepsecs, 2)) + " s)")
+        built[name] = (dataset, status, gensecs, prepsecs)
+
+    names = [name for name in sorted(built) if built[name][1] in ['ok', 'cached']]
+    printcov("Tracing: " + str(len(names)) + " datasets with: " + str(len(sweep_radius)) + " radii each.")
+    rows = []
+    for (status, secs), name in zip(pool.imap(trace_dataset, names), names):
+        printcov("Dataset: " + name + ": " + status + " (traced in: " + str(round(secs, 2)) + " s)")
+        (pop, sick, startloc), built_status, gensecs, prepsecs = built[name]
+        for radius in sweep_radius:
+            row = {'dataset': name, 'pop': pop, 'sick_percent': sick, 'startloc': startloc,
+                'radius': radius, 'status': status, 'gen_secs': gensecs, 'prep_secs': prepsecs,
+                'trace_secs': secs}
+            if(status == 'ok'):
+                row.update(scenario_results(name, radius))
+            rows.append(row)
+    pool.close()
+    pool.join()
+
+    #datasets that could not be built are listed without a radius
+    for name in sorted(built):
+        (pop, sick, startloc), status, gensecs, prepsecs = built[name]
+        if(status not in ['ok', 'cached']):
+            rows.append({'dataset': name, 'pop': pop, 'sick_percent': sick, 'startloc': startloc,
+                'status': status, 'gen_secs': gensecs, 'prep_secs': prepsecs})
+    summary = pd.DataFrame(rows, columns = col_summary)
+    summary.to_csv(os.path.join(sweep_folder, "sweep_summary.csv"), index=False)
+    printcov("Sweep summary (also in: " + os.path.join(sweep_folder, "sweep_summary.csv") + "): ")
+    print(summary.to_string(index=False))
+    return summary
+
+##### main #####
+
+printcov("Starting sweep in: " + sweep_folder)
+print("Populations: " + str(sweep_pop))
+print("Sick percentages: " + str(sweep_sick_percent))
+print("Start locations: " + str(sweep_startloc))
+print("Microcell radii: " + str(sweep_radius))
+print("Generation engine: " + sweep_engine + ", seed: " + str(sweep_seed))
+print("Jobs at a time: " + str(sweep_workers))
+print('-------------------------------------')
+run_sweep()
+printcov("Completed sweep.")